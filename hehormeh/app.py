@@ -1,30 +1,43 @@
 """Main module for the hehormeh Flask app."""
 
-import hashlib
-import os
+import threading
+import time
 from pathlib import Path
 
-from flask import Flask, abort, redirect, render_template, request, url_for
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, abort, g, redirect, render_template, request, url_for
 
+from . import ingest, metrics, serving
+from .blobs import spool
 from .config import (
-    HASH_SIZE,
-    ID2CAT,
-    ID2CAT_ALL,
     IP_TO_USER_FILE,
     QR_CODE_IMAGE_FILE_NAME,
-    ROOT_DIR,
+    QR_CODE_IMAGE_SAVE_PATH,
+    SCORING_MODES,
+    SHARED_STATE_POLL,
+    SPOOL_PATH,
     TRASH_ID,
-    UPLOAD_PATH,
-    USER_TO_IMAGE_FILE,
+    VOTE_PAGE_SIZE,
+    VOTE_RANGE,
     VOTES_FILE,
+    Config,
+    get_config,
+    set_config,
 )
+from .images import image_size, schedule_variants, srcset, variants_generation
+from .nights import NIGHTS, current, serve
+from .reposts import REPOSTS, index_upload
 from .utils import (
     Stages,
+    add_uploads,
+    archive_night,
     generate_server_link_qr_code,
+    get_award_confidence,
+    get_category_uploads,
     get_image_and_author_info,
     get_next_votable_category_id,
     get_private_ip,
+    get_reposts,
+    get_scoreboard,
     get_uploaded_images,
     get_uploaded_images_info,
     get_user_or_none,
@@ -33,19 +46,180 @@ from .utils import (
     is_host_address,
     is_voting_valid,
     reset_image,
-    score_memes,
-    score_users,
+    scoring_mode,
+    users_missing_vote,
     users_voting_status,
     users_voting_status_all,
     write_data,
 )
 
-app = Flask(__name__, static_folder=ROOT_DIR / "static")
-app.config["UPLOAD_FOLDER"] = UPLOAD_PATH
-app.config["MAX_CONTENT_LENGTH"] = 10 * 1024**2  # Limit upload data to 10 MiB
-
-CURRENT_STAGE = Stages.UPLOAD
-CURRENT_CAT_ID = get_next_votable_category_id()
+_ROUTES = []
+_APP = None
+_WATCHER = None
+_VOTE_FIELDS = {"cat_id": int, "img_name": str, "funny": int, "cringe": int}  # of every vote, by their types
+
+
+def current_stage() -> Stages:
+    """Return the current stage of the night."""
+    return Stages[current().shared.get("stage")]
+
+
+def publish_stage(stage: Stages) -> None:
+    """Tell the clients about the stage, and reveal the awards with the winner announcement."""
+    events = current().events
+    events.publish("stage", {"stage": stage.name})
+    if stage == Stages.WINNER_ANNOUNCEMENT:
+        meme_scores, user_scores = get_scoreboard()
+        events.publish("reveal", {"score_memes": meme_scores, "score_users": user_scores})
+        serving.warm_memes(list(meme_scores.values()))
+    elif stage in (Stages.VIEWING, Stages.VOTING):
+        # every client asks for the memes of the category at once
+        cat_id = get_next_votable_category_id()
+        if cat_id is not None:
+            serving.warm_memes(list(get_image_and_author_info(cat_id, None)))
+
+
+def set_stage(stage: Stages) -> None:
+    """Change the current stage and tell the clients about it, and archive the night once its winners are known."""
+    current().shared.update(stage=stage.name)
+    publish_stage(stage)
+    if stage == Stages.WINNER_ANNOUNCEMENT:
+        archive_night()
+
+
+def update_current_category() -> None:
+    """Move on to viewing the next category once everyone voted in the current one."""
+    night = current()
+    # a single check-and-set for all workers, taking the locks in the order of the writer thread
+    with night.state.lock, night.shared.lock:
+        new_cat_id = get_next_votable_category_id()
+        values = night.shared.values()
+        if "cat_id" not in values:
+            night.shared.update(cat_id=new_cat_id)
+        elif values["cat_id"] != new_cat_id:
+            night.shared.update(cat_id=new_cat_id, stage=Stages.VIEWING.name)
+            publish_stage(Stages.VIEWING)
+
+
+def publish_voting_progress() -> None:
+    """Tell the clients who still has to vote in the current category, unless they know already."""
+    night = current()
+    cat_id = get_next_votable_category_id()
+    status = users_voting_status(cat_id) if cat_id is not None else {}
+    progress = {
+        "cat_id": cat_id,
+        "category": get_config().id2cat.get(cat_id),
+        "voted": sum(status.values()),
+        "total": len(status),
+        "missing": [user for user, voted in status.items() if not voted],
+    }
+    if progress != night.last_progress:
+        night.last_progress = progress
+        night.events.publish("progress", progress)
+
+
+def watch_other_workers(interval: float = SHARED_STATE_POLL) -> None:
+    """Pass the changes made by other worker processes on to the clients of this one, in a background thread.
+
+    The thread also unloads the nights that became idle.
+    """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            for night in NIGHTS.loaded():
+                with serve(night):
+                    if night.shared.changed():
+                        publish_stage(current_stage())
+
+                    version = night.state.data_version()
+                    if version != night.watched_version:
+                        night.watched_version = version
+                        publish_voting_progress()
+            NIGHTS.evict_idle()
+
+    global _WATCHER
+
+    if _WATCHER is None:
+        _WATCHER = threading.Thread(target=run, name="watcher", daemon=True)
+        _WATCHER.start()
+
+
+def route(rule: str, **options):
+    """Register the function as the view of the URL rule, to be added to the app by `create_app`."""
+
+    def decorator(func):
+        _ROUTES.append((rule, func, options))
+        return func
+
+    return decorator
+
+
+def create_app(config: Config | None = None) -> Flask:
+    """Create the app for the meme night of the configuration, or of the one read from the environment."""
+    if config is not None:
+        set_config(config)
+    config = get_config()
+
+    app = Flask(__name__, static_folder=None)
+    serving.init_app(app)
+    metrics.init_app(app)
+    app.config["UPLOAD_FOLDER"] = config.upload_path
+    app.config["MAX_CONTENT_LENGTH"] = 10 * 1024**2  # Limit upload data to 10 MiB
+    app.jinja_env.globals["srcset"] = srcset
+    app.jinja_env.globals["image_size"] = image_size
+    for rule, func, options in _ROUTES:
+        # the configured night is served under `/`, every night under `/e/<year>/`
+        app.add_url_rule(rule, view_func=func, **options)
+        app.add_url_rule(f"/e/<year>{rule}", view_func=func, **options)
+    endpoints = {func.__name__ for _, func, _ in _ROUTES}
+
+    @app.url_value_preprocessor
+    def serve_night(endpoint, values):
+        year = values.pop("year", None) if values else None
+        try:
+            night = NIGHTS.get(year) if year is not None else NIGHTS.main()
+        except KeyError:
+            abort(404, description=f"There is no meme night of {year}!")
+        g.night_year = year
+        g.night_context = serve(night)
+        g.night_context.__enter__()
+
+    @app.teardown_request
+    def leave_night(exc):
+        night_context = g.pop("night_context", None)
+        if night_context is not None:
+            night_context.__exit__(None, None, None)
+
+    @app.url_defaults
+    def add_night_year(endpoint, values):
+        # links stay within the namespace of the night
+        if endpoint in endpoints and "year" not in values and g.get("night_year"):
+            values["year"] = g.night_year
+
+    with serve(NIGHTS.main()):
+        update_current_category()
+    watch_other_workers()
+    return app
+
+
+def __getattr__(name: str):
+    """Create the default app on first access, e.g. by `flask --app hehormeh.app`."""
+    global _APP
+
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _APP is None:
+        _APP = create_app()
+    return _APP
+
+
+def render_cached(route_name: str, user: str | None, cat_id: int | None, render, page: int = 0) -> str:
+    """Return a page or fragment from the render cache, keyed on everything it depends on."""
+    night = current()
+    key = (route_name, user, cat_id, current_stage().name, page)
+    version = night.state.data_version(), variants_generation(), night.jobs.signature(), REPOSTS.signature()
+    return night.render_cache.get_or_render(key, version, render)
 
 
 def get_remote_addr(request):
@@ -53,38 +227,39 @@ def get_remote_addr(request):
     return request.headers.get("X-Test-IP", request.remote_addr)
 
 
-@app.route("/", methods=["GET", "POST"])
+@route("/", methods=["GET", "POST"])
 def index():
     """Display the main page of the app."""
-    global CURRENT_STAGE
-    global CURRENT_CAT_ID
-
     username = get_user_or_none(get_remote_addr(request))
     if not username:
         return redirect(url_for("login"))
 
-    new_cat_it = get_next_votable_category_id()
-    if CURRENT_CAT_ID != new_cat_it:
-        CURRENT_CAT_ID = new_cat_it
-        CURRENT_STAGE = Stages.VIEWING
-
-    user_voted_status = users_voting_status(new_cat_it)
+    update_current_category()
+    user_voted_status = users_voting_status(current().shared.get("cat_id"))
     address = get_remote_addr(request)
+    preload_images = []
+    if current_stage() == Stages.VIEWING and not is_host_address(address):
+        cat_id = get_next_votable_category_id()
+        if cat_id is not None:
+            preload_images = list(get_image_and_author_info(cat_id, username))[:VOTE_PAGE_SIZE]
     return render_template(
         "index.html",
         username=username,
         voted_status=user_voted_status.get(username, False),
+        n_voted=sum(user_voted_status.values()),
+        n_users=len(user_voted_status),
         is_host_admin=is_host_address(address),
-        curr_stage=CURRENT_STAGE.name,
+        curr_stage=current_stage().name,
+        preload_images=preload_images,
     )
 
 
-@app.route("/login", methods=["GET", "POST"])
+@route("/login", methods=["GET", "POST"])
 def login():
     """Display the login page of the app."""
     username = get_user_or_none(get_remote_addr(request))
     if username:
-        return redirect("/")
+        return redirect(url_for("index"))
 
     if request.method == "POST":
         new_username = request.form["user"]
@@ -96,39 +271,85 @@ def login():
 
         content = [{"ip": get_remote_addr(request), "user": new_username}]
         write_data(content, IP_TO_USER_FILE)
-        return redirect("/")
+        publish_voting_progress()
+        return redirect(url_for("index"))
 
     return render_template("login.html", username=username)
 
 
-@app.route("/vote", methods=["GET", "POST"])
+@route("/vote", methods=["GET", "POST"])
 def vote():
     """Display the images for a given category."""
-    if CURRENT_STAGE != Stages.VOTING:
+    if current_stage() != Stages.VOTING:
         abort(403, description="Voting not yet started!")
 
     username = get_user_or_none(get_remote_addr(request))
     if request.method == "POST":
-        cat_id = int(request.form["cat_id"])
-        img_names = {int(k.split("_")[-1]): v for k, v in request.form.items() if "img_name" in k}
-
-        funny_votes = {int(k.split("_")[-1]): int(v) for k, v in request.form.items() if "funny" in k}
-        cringe_votes = {int(k.split("_")[-1]): int(v) for k, v in request.form.items() if "cringe" in k}
-
-        if not is_voting_valid(funny_votes, cringe_votes):
-            abort(400, description="Make sure you vote for all the memes!")
-
-        contents = []
-        kwargs = {"user": username, "cat_id": cat_id}
-        for idx, img_name in img_names.items():
-            contents.append({**kwargs, "img_name": img_name, "funny": funny_votes[idx], "cringe": cringe_votes[idx]})
-
-        write_data(contents, VOTES_FILE, check_cols=["user", "cat_id", "img_name"])
-        return redirect("/")
+        cat_id = request.form.get("cat_id", type=int)
+        # the fields of the i-th meme are img_name_<i>, funny_slider_<i> and cringe_slider_<i>
+        fields: dict[int, dict] = {}
+        for key, value in request.form.items():
+            field = next((field for field in ["img_name", "funny", "cringe"] if field in key), None)
+            if field is not None:
+                # values that are not integers are left out, so `submit_votes` rejects their votes as incomplete
+                value = value if field == "img_name" else request.form.get(key, type=int)
+                if value is not None:
+                    fields.setdefault(int(key.split("_")[-1]), {})[field] = value
+
+        # the form is split into pages, `submit_votes` makes sure the values of all of them made it
+        submit_votes(username, [{"cat_id": cat_id, **meme} for meme in fields.values() if "img_name" in meme])
+        return redirect(url_for("index"))
 
     cat_id = get_next_votable_category_id()
-    img_and_author_info = get_image_and_author_info(cat_id, username)
-    return render_template("vote.html", cat_id=cat_id, cat=ID2CAT[cat_id], image_and_author_info=img_and_author_info)
+    page = request.args.get("page", 0, type=int)
+
+    def render():
+        images = list(get_image_and_author_info(cat_id, username).items())
+        n_pages = max((len(images) + VOTE_PAGE_SIZE - 1) // VOTE_PAGE_SIZE, 1)
+        if not 0 <= page < n_pages:
+            abort(404)
+        offset = page * VOTE_PAGE_SIZE
+        return render_template(
+            "vote.html",
+            cat_id=cat_id,
+            cat=get_config().id2cat[cat_id],
+            page_images=images[offset : offset + VOTE_PAGE_SIZE],
+            offset=offset,
+            page=page,
+            n_pages=n_pages,
+            votable=[[idx, Path(image).name] for idx, (image, is_author) in enumerate(images) if not is_author],
+        )
+
+    return render_cached("vote", username, cat_id, render, page=page)
+
+
+def submit_votes(username: str, votes: list[dict]) -> None:
+    """Validate the votes of a user, for one or more categories, and write them with a single commit.
+
+    The user has to vote for every meme of the others in each category, once and with values in `VOTE_RANGE`.
+    """
+    for vote in votes:
+        if any(type(vote.get(field)) is not field_type for field, field_type in _VOTE_FIELDS.items()):
+            abort(400, description=f"Make sure you vote for all the memes, from {VOTE_RANGE[0]} to {VOTE_RANGE[1]}!")
+        if vote["cat_id"] not in get_config().id2cat:
+            abort(400, description=f"Unknown category {vote['cat_id']}!")
+
+    funny_votes = {idx: vote["funny"] for idx, vote in enumerate(votes)}
+    cringe_votes = {idx: vote["cringe"] for idx, vote in enumerate(votes)}
+    if not is_voting_valid(funny_votes, cringe_votes):
+        abort(400, description=f"Make sure you vote for all the memes, from {VOTE_RANGE[0]} to {VOTE_RANGE[1]}!")
+
+    voted: dict[int, list[str]] = {}
+    for vote in votes:
+        voted.setdefault(vote["cat_id"], []).append(vote["img_name"])
+    for cat_id, img_names in voted.items():
+        votable = {row["img_name"] for row in get_category_uploads(cat_id) if row["user"] != username}
+        if len(img_names) != len(votable) or set(img_names) != votable:
+            abort(400, description="Make sure you vote for all the memes of the others, once each!")
+
+    write_data([{"user": username, **vote} for vote in votes], VOTES_FILE, check_cols=["user", "cat_id", "img_name"])
+    publish_voting_progress()
+    update_current_category()
 
 
 def upload_handler(request):
@@ -137,7 +358,8 @@ def upload_handler(request):
     image_to_reset = request.form.get("image_to_reset")
 
     if image_to_reset:
-        reset_image(image_to_reset)
+        if not reset_image(username, image_to_reset):
+            abort(403, description="You can only remove your own memes!")
         return redirect(request.url)
 
     file = request.files.get("file", None)
@@ -145,81 +367,239 @@ def upload_handler(request):
         return redirect(request.url)
 
     if file and has_valid_extension(file.filename):
-        filename = secure_filename(file.filename)
-        hash_name = hashlib.sha256(filename.encode()).hexdigest()[:HASH_SIZE] + Path(filename).suffix
-        cat_id = int(request.form.get("cat_id"))
-
-        os.makedirs(ROOT_DIR / UPLOAD_PATH / ID2CAT_ALL[cat_id], exist_ok=True)
-        file.save(UPLOAD_PATH / ID2CAT_ALL[cat_id] / hash_name)
-
-        content = [{"user": username, "cat_id": cat_id, "img_name": hash_name}]
-        write_data(content, USER_TO_IMAGE_FILE)
+        # the image is validated and registered in the background, the page shows its status meanwhile
+        ingest.accept(username, file.stream, file.filename, int(request.form.get("cat_id")))
         return redirect(request.url)
 
 
-@app.route("/upload", methods=["POST", "GET"])
+@route("/upload", methods=["POST", "GET"])
 def upload():
     """Display the upload page of the app."""
     if request.method == "POST":
         return upload_handler(request)
 
     username = get_user_or_none(get_remote_addr(request))
-    user_images = get_uploaded_images(username)
-    return render_template("upload.html", categories=ID2CAT_ALL, trash_cat_id=TRASH_ID, user_images=user_images)
+    return render_cached(
+        "upload",
+        username,
+        None,
+        lambda: render_template(
+            "upload.html",
+            categories=get_config().id2cat_all,
+            trash_cat_id=TRASH_ID,
+            user_images=get_uploaded_images(username),
+            upload_jobs=ingest.user_jobs(username),
+            reposts={repost["image"]: repost["matches"] for repost in get_reposts(username)},
+        ),
+    )
 
 
-@app.route("/scoreboard", methods=["GET", "POST"])
+@route("/scoreboard", methods=["GET", "POST"])
 def scoreboard():
     """Display the scoreboard."""
-    global CURRENT_STAGE
-
-    if CURRENT_STAGE not in [Stages.SCORE_CALC, Stages.WINNER_ANNOUNCEMENT]:
+    if current_stage() not in [Stages.SCORE_CALC, Stages.WINNER_ANNOUNCEMENT]:
         abort(403, description="Scoreboard not ready yet!")
 
     if request.method == "POST":
-        CURRENT_STAGE = Stages[request.form.get("stage")]
-        return redirect("/scoreboard")
+        set_stage(Stages[request.form.get("stage")])
+        return redirect(url_for("scoreboard"))
 
+    meme_scores, user_scores = get_scoreboard()
     return render_template(
-        "scoreboard.html", score_memes=score_memes(), score_users=score_users(), stage=CURRENT_STAGE.name
+        "scoreboard.html",
+        score_memes=meme_scores,
+        score_users=user_scores,
+        confidence=get_award_confidence(),
+        stage=current_stage().name,
     )
 
 
-@app.route("/admin", methods=["POST", "GET"])
+@route("/hall-of-fame")
+def hall_of_fame():
+    """Display the awards of every archived night and the best users and memes over all years."""
+    from .archive import ARCHIVE
+
+    return render_template("hall_of_fame.html", **ARCHIVE.hall_of_fame())
+
+
+@route("/api/hall-of-fame")
+def api_hall_of_fame():
+    """Return the hall of fame as JSON, with the winners of `?award=` instead if it is given."""
+    from .archive import ARCHIVE
+
+    award = request.args.get("award")
+    return {"award_wins": ARCHIVE.award_wins(award)} if award else ARCHIVE.hall_of_fame()
+
+
+@route("/api/hall-of-fame/users/<user>")
+def api_user_trend(user: str):
+    """Return the results of a user in every archived night as JSON."""
+    from .archive import ARCHIVE
+
+    trend = ARCHIVE.user_trend(user)
+    if not trend:
+        abort(404, description=f"{user} is in no archived night!")
+    return {"user": user, "years": trend}
+
+
+@route("/admin", methods=["POST", "GET"])
 def admin():
     """Display info about users and control staging."""
-    global CURRENT_STAGE
-
     address = get_remote_addr(request)
     if not is_host_address(address):
-        return redirect("/")
+        return redirect(url_for("index"))
 
     if request.method == "POST":
         new_stage = request.form.get("stage")
-        CURRENT_STAGE = Stages[new_stage] if new_stage else CURRENT_STAGE
+        if new_stage:
+            set_stage(Stages[new_stage])
+
+        if request.form.get("scoring") in SCORING_MODES:
+            current().shared.update(scoring=request.form["scoring"])
 
         if request.form.get("generate_qr"):
             addr = get_private_ip()
             port = request.environ.get("SERVER_PORT")
             generate_server_link_qr_code(addr, port)
+            serving.precompress(QR_CODE_IMAGE_SAVE_PATH)
+
+        if request.form.get("compact"):
+            current().state.compact()
 
         return redirect(request.url)
 
     cat_id = get_next_votable_category_id()
+    current_cat = get_config().id2cat[cat_id] if cat_id is not None else None
+    # the users table changes only with the data, unlike the stage and the metrics below it
+    users_table = render_cached(
+        "admin",
+        None,
+        cat_id,
+        lambda: render_template(
+            "admin_users.html",
+            categories=get_config().id2cat_all,
+            user_uploads=get_uploaded_images_info(),
+            user_votes=users_voting_status_all(),
+            user_ips=get_users_ips(),
+            trash_cat_id=TRASH_ID,
+            current_cat=current_cat,
+            missing_voters=users_missing_vote(cat_id) if cat_id is not None else [],
+            reposts=get_reposts(),
+        ),
+    )
     return render_template(
         "admin.html",
-        categories=ID2CAT_ALL,
-        user_uploads=get_uploaded_images_info(),
-        user_votes=users_voting_status_all(),
-        user_ips=get_users_ips(),
-        trash_cat_id=TRASH_ID,
-        current_cat=ID2CAT[cat_id] if cat_id is not None else None,
-        curr_stage=CURRENT_STAGE.name,
-        qr_code_img=f"static/{QR_CODE_IMAGE_FILE_NAME}",
+        users_table=users_table,
+        current_cat=current_cat,
+        curr_stage=current_stage().name,
+        scoring=scoring_mode(),
+        scoring_modes=SCORING_MODES,
+        qr_code_img=url_for("static", filename=QR_CODE_IMAGE_FILE_NAME),
+        metrics=metrics.REGISTRY.summary() if metrics.ENABLED else None,
+        render_cache=current().render_cache.stats(),
+        hot_files=serving.HOT_FILES.stats(),
+        nights=[night.year for night in NIGHTS.loaded()],
     )
 
 
-@app.route("/qr")
+def _api_user() -> str:
+    username = get_user_or_none(get_remote_addr(request))
+    if not username:
+        abort(403, description="Please log in first!")
+    return username
+
+
+@route("/api/votes", methods=["POST"])
+def api_votes():
+    """Accept the votes of a user for one or more categories as JSON, written with a single commit.
+
+    The body is `{"votes": [{"cat_id": 0, "img_name": "...", "funny": 0-100, "cringe": 0-100}, ...]}`, with a vote
+    for every meme of the others in each of the categories.
+    """
+    if current_stage() != Stages.VOTING:
+        abort(403, description="Voting not yet started!")
+
+    username = _api_user()
+    votes = (request.get_json(silent=True) or {}).get("votes")
+    if not isinstance(votes, list) or not votes:
+        abort(400, description="Expected a non-empty list of votes!")
+
+    for vote in votes:
+        if not isinstance(vote, dict) or vote.keys() != _VOTE_FIELDS.keys():
+            abort(400, description=f"Every vote needs exactly the fields {', '.join(_VOTE_FIELDS)}!")
+
+    submit_votes(username, votes)
+    return {"votes": len(votes)}
+
+
+@route("/api/uploads", methods=["POST"])
+def api_uploads():
+    """Accept several files in one multipart request, written with a single commit.
+
+    Every `file` field needs a `cat_id` field in the same order, or a single `cat_id` applies to all files. Unlike
+    the form, the images are validated and registered before the response.
+    """
+    username = _api_user()
+    files = request.files.getlist("file")
+    cat_ids = request.form.getlist("cat_id", type=int)
+    if not files or any(not file.filename or not has_valid_extension(file.filename) for file in files):
+        abort(400, description="Expected one or more images!")
+    if len(cat_ids) == 1:
+        cat_ids *= len(files)
+    if len(cat_ids) != len(files) or any(cat_id not in get_config().id2cat_all for cat_id in cat_ids):
+        abort(400, description="Expected a known category for every file!")
+
+    stored = []
+    try:
+        for file, cat_id in zip(files, cat_ids):
+            path, digest = spool(file.stream, SPOOL_PATH)
+            stored.append(ingest.register(username, path, digest, cat_id))
+        add_uploads([row for row, _, _ in stored])
+    except Exception as e:
+        # nothing of the request is written, so remove the images it added
+        for row, img_path, is_new in stored:
+            ingest.discard(row, img_path, is_new)
+        if isinstance(e, ingest.DuplicateUploadError):
+            abort(409, description=str(e))
+        if isinstance(e, ingest.InvalidImageError):
+            abort(400, description=str(e))
+        raise
+
+    for _, img_path, is_new in stored:
+        if is_new:
+            schedule_variants(img_path)
+            index_upload(img_path)
+    return {"uploads": [row for row, _, _ in stored]}
+
+
+@route("/metrics")
+def metrics_endpoint():
+    """Expose the metrics to the host in the Prometheus text format."""
+    if not metrics.ENABLED:
+        abort(404)
+    if not is_host_address(get_remote_addr(request)):
+        abort(403)
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@route("/qr")
 def qr():
     """Display QR code to connect to the server."""
-    return render_template("qr.html", qr_code_img=f"static/{QR_CODE_IMAGE_FILE_NAME}")
+    return render_template("qr.html", qr_code_img=url_for("static", filename=QR_CODE_IMAGE_FILE_NAME))
+
+
+@route("/events")
+def events():
+    """Stream stage changes, voting progress and award reveals as server-sent events."""
+    # the streams of all nights hold the threads of this worker
+    events = current().events
+    if NIGHTS.n_listeners() >= get_config().max_event_listeners or not events.register():
+        abort(503, description="Too many listeners!")
+
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    response = Response(events.listen(last_id), mimetype="text/event-stream")
+    # the server closes the response even if the client left before the stream started, unlike the generator
+    response.call_on_close(events.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # don't let a fronting proxy buffer the stream
+    return response
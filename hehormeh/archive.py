@@ -0,0 +1,272 @@
+"""Archive of the results of past nights, for the hall of fame over all years.
+
+Once the winners of a night are announced, its uploads, votes and awards are frozen into `ARCHIVE_PATH/<year>/`,
+a NumPy file per column with the users and memes as codes into sorted arrays of their names. The columns are
+memory-mapped when they are read, so a query over all years reads only the columns it needs.
+"""
+
+import functools
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .config import ARCHIVE_PATH, HALL_OF_FAME_MIN_VOTES, HALL_OF_FAME_SIZE
+
+AWARDS_FILE_NAME = "awards.json"
+
+
+def write_night(
+    path: Path,
+    uploads: dict[str, list],
+    votes: dict[str, list],
+    meme_paths: dict[tuple[int, str], str],
+    awards: dict[str, dict[str, str]],
+) -> None:
+    """Write the uploads and votes of a night, with the memes of `meme_paths` by (cat_id, img_name), and its awards.
+
+    Uploads that are not in `meme_paths` (e.g. the trash) and the votes for them are left out. An archive of the
+    night that is there already is replaced at once, so the readers see either of them.
+    """
+    authors = {
+        meme_paths[key]: user
+        for user, key in zip(uploads["user"], zip(uploads["cat_id"], uploads["img_name"]))
+        if key in meme_paths
+    }
+    memes = np.array(sorted(authors), dtype=str)
+    users = np.unique(np.array(uploads["user"] + votes["user"], dtype=str))
+    meme_pos = {meme: pos for pos, meme in enumerate(memes.tolist())}
+    vote_meme = np.array(
+        [meme_pos.get(meme_paths.get(key), -1) for key in zip(votes["cat_id"], votes["img_name"])], dtype=np.intp
+    )
+    kept = vote_meme >= 0
+    columns = {
+        "users": users,
+        "memes": memes,
+        "meme_author": np.searchsorted(users, np.array([authors[meme] for meme in memes.tolist()], dtype=str)),
+        "vote_user": np.searchsorted(users, np.array(votes["user"], dtype=str))[kept],
+        "vote_meme": vote_meme[kept],
+        "vote_funny": np.array(votes["funny"], dtype=np.int16)[kept],
+        "vote_cringe": np.array(votes["cringe"], dtype=np.int16)[kept],
+    }
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    for name, values in columns.items():
+        np.save(tmp_path / f"{name}.npy", values.astype(np.int32) if values.dtype == np.intp else values)
+    with open(tmp_path / AWARDS_FILE_NAME, "w") as f:
+        json.dump(awards, f, ensure_ascii=False, indent=2)
+
+    old_path = path.with_name(f".{path.name}.old.{os.getpid()}")
+    if path.exists():
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+class ArchivedNight:
+    """The memory-mapped columns and the awards of an archived night, which never change."""
+
+    def __init__(self, path: Path):
+        self.year = path.name
+        self.columns = {file.stem: np.load(file, mmap_mode="r", allow_pickle=False) for file in path.glob("*.npy")}
+        with open(path / AWARDS_FILE_NAME) as f:
+            self.awards = json.load(f)
+
+    @functools.cached_property
+    def meme_sums(self) -> np.ndarray:
+        """The number of votes and the funny and cringe sums of every meme, as rows."""
+        n_memes = len(self.columns["memes"])
+        vote_meme = self.columns["vote_meme"]
+        return np.stack(
+            [
+                np.bincount(vote_meme, minlength=n_memes),
+                np.bincount(vote_meme, self.columns["vote_funny"], minlength=n_memes),
+                np.bincount(vote_meme, self.columns["vote_cringe"], minlength=n_memes),
+            ]
+        )
+
+    @functools.cached_property
+    def author_sums(self) -> np.ndarray:
+        """The number of memes and votes and the funny and cringe sums of every user, as rows."""
+        authors, n_users = self.columns["meme_author"], len(self.columns["users"])
+        meme_sums = self.meme_sums
+        return np.stack(
+            [
+                np.bincount(authors, minlength=n_users),
+                *(np.bincount(authors, row, minlength=n_users) for row in meme_sums),
+            ]
+        )
+
+    def award_winners(self) -> dict[str, str]:
+        """Return the user who won every award, the author of the meme for the meme awards."""
+        memes, users = self.columns["memes"], self.columns["users"]
+        winners = dict(self.awards["users"])
+        for award, meme in self.awards["memes"].items():
+            pos = np.searchsorted(memes, meme)
+            if pos < len(memes) and memes[pos] == meme:
+                winners[award] = str(users[self.columns["meme_author"][pos]])
+        return winners
+
+
+class Archive:
+    """The archived nights of all years, with the queries of the hall of fame.
+
+    The nights are loaded again whenever their folders change, and the queries are answered once per change.
+    """
+
+    def __init__(self, path: Path = ARCHIVE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self._nights: dict[str, tuple[tuple[int, int], ArchivedNight]] = {}
+        self._results: dict[tuple, object] = {}
+
+    def signature(self) -> tuple:
+        """Return a value that changes whenever a night is archived."""
+        if not self.path.is_dir():
+            return ()
+        return tuple(
+            (entry.name, entry.inode(), entry.stat().st_mtime_ns)
+            for entry in sorted(os.scandir(self.path), key=lambda entry: entry.name)
+            if entry.is_dir() and not entry.name.startswith(".")
+        )
+
+    def nights(self) -> list[ArchivedNight]:
+        """Return the archived nights, by year."""
+        signature = self.signature()
+        with self.lock:
+            nights = {}
+            for year, inode, mtime in signature:
+                cached = self._nights.get(year)
+                if cached is None or cached[0] != (inode, mtime):
+                    cached = (inode, mtime), ArchivedNight(self.path / year)
+                nights[year] = cached
+            self._nights = nights
+            return [night for _, night in nights.values()]
+
+    def write(self, year: str, *args, **kwargs) -> None:
+        """Archive the night of the year, see `write_night`."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        write_night(self.path / year, *args, **kwargs)
+
+    def _cached(self, query: tuple, compute):
+        key = self.signature(), query
+        with self.lock:
+            if key in self._results:
+                return self._results[key]
+        result = compute()
+        with self.lock:
+            self._results = {key: result, **{k: v for k, v in self._results.items() if k[0] == key[0]}}
+        return result
+
+    def award_wins(self, award: str | None = None) -> list[dict]:
+        """Return the users by the number of awards they won over all years, or of the one award."""
+
+        def compute():
+            wins = {}
+            for night in self.nights():
+                for name, user in night.award_winners().items():
+                    if award is None or name == award:
+                        wins.setdefault(user, []).append({"year": night.year, "award": name})
+            ranked = sorted(wins.items(), key=lambda item: (-len(item[1]), item[0]))
+            return [{"user": user, "wins": len(won), "awards": won} for user, won in ranked]
+
+        return self._cached(("award_wins", award), compute)
+
+    def user_totals(self) -> list[dict]:
+        """Return the users by the mean funny and cringe score their memes got over all years, highest first."""
+
+        def compute():
+            users, totals = [], []
+            for night in self.nights():
+                users.append(night.columns["users"])
+                totals.append(night.author_sums)
+            if not users:
+                return []
+            names, codes = np.unique(np.concatenate(users), return_inverse=True)
+            sums = np.stack([np.bincount(codes, row, minlength=len(names)) for row in np.hstack(totals)])
+            n_years = np.bincount(codes, minlength=len(names))
+            memes, n_votes, funny, cringe = sums
+            voted = n_votes > 0
+            mean_funny, mean_cringe = funny[voted] / n_votes[voted], cringe[voted] / n_votes[voted]
+            order = np.lexsort((names[voted], -(mean_funny + mean_cringe)))
+            return [
+                {
+                    "user": str(names[voted][i]),
+                    "years": int(n_years[voted][i]),
+                    "memes": int(memes[voted][i]),
+                    "votes": int(n_votes[voted][i]),
+                    "funny": round(float(mean_funny[i]), 2),
+                    "cringe": round(float(mean_cringe[i]), 2),
+                }
+                for i in order
+            ]
+
+        return self._cached(("user_totals",), compute)
+
+    def user_trend(self, user: str) -> list[dict]:
+        """Return the memes, votes and mean scores of the user in every year they took part in."""
+
+        def compute():
+            trend = []
+            for night in self.nights():
+                users = night.columns["users"]
+                pos = np.searchsorted(users, user)
+                if pos == len(users) or users[pos] != user:
+                    continue
+                memes, n_votes, funny, cringe = night.author_sums[:, pos]
+                trend.append(
+                    {
+                        "year": night.year,
+                        "memes": int(memes),
+                        "votes": int(n_votes),
+                        "funny": round(float(funny / n_votes), 2) if n_votes else None,
+                        "cringe": round(float(cringe / n_votes), 2) if n_votes else None,
+                        "awards": [award for award, winner in night.award_winners().items() if winner == user],
+                    }
+                )
+            return trend
+
+        return self._cached(("user_trend", user), compute)
+
+    def top_memes(self, n: int = HALL_OF_FAME_SIZE, min_votes: int = HALL_OF_FAME_MIN_VOTES) -> list[dict]:
+        """Return the memes of all years with the highest mean funny and cringe score, with at least `min_votes`."""
+
+        def compute():
+            best = []
+            for night in self.nights():
+                n_votes, funny, cringe = night.meme_sums
+                means = np.divide(funny + cringe, n_votes, out=np.full(len(n_votes), -np.inf), where=n_votes > 0)
+                means[n_votes < min_votes] = -np.inf
+                # the best of every year are enough to find the best of all years
+                for pos in np.argsort(-means, kind="stable")[:n]:
+                    if np.isfinite(means[pos]):
+                        best.append(
+                            {
+                                "meme": str(night.columns["memes"][pos]),
+                                "user": str(night.columns["users"][night.columns["meme_author"][pos]]),
+                                "year": night.year,
+                                "votes": int(n_votes[pos]),
+                                "funny": round(float(funny[pos] / n_votes[pos]), 2),
+                                "cringe": round(float(cringe[pos] / n_votes[pos]), 2),
+                            }
+                        )
+            return sorted(best, key=lambda meme: -(meme["funny"] + meme["cringe"]))[:n]
+
+        return self._cached(("top_memes", n, min_votes), compute)
+
+    def hall_of_fame(self, n: int = HALL_OF_FAME_SIZE) -> dict:
+        """Return the awards of every year and the best users and memes over all years."""
+        return {
+            "years": {night.year: night.awards for night in reversed(self.nights())},
+            "award_wins": self.award_wins()[:n],
+            "users": self.user_totals()[:n],
+            "memes": self.top_memes(n),
+        }
+
+
+ARCHIVE = Archive()
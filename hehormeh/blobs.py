@@ -0,0 +1,83 @@
+"""Content-addressed storage of the uploaded memes.
+
+Every distinct file is stored once in `BLOB_PATH`, named by the SHA-256 of its content, and hard-linked into the
+category folders. The link count of a blob is its reference count.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+from .config import BLOB_PATH, HASH_SIZE
+from .metrics import timed
+
+CHUNK_SIZE = 64 * 1024
+
+
+def spool(stream: BinaryIO, folder: Path = BLOB_PATH) -> tuple[Path, str]:
+    """Stream the data into a new file in the folder, hashing it on the way. Return the file and the content hash."""
+    os.makedirs(folder, exist_ok=True)
+    sha256 = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=folder, prefix=".", delete=False) as tmp:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            tmp.write(chunk)
+    return Path(tmp.name), sha256.hexdigest()
+
+
+def add_blob(path: Path, digest: str) -> bool:
+    """Move a file with the content hash into the blob store. Return whether identical bytes were already stored.
+
+    The file must be on the same file system as the blob store.
+    """
+    os.makedirs(BLOB_PATH, exist_ok=True)
+    try:
+        # linking fails if the blob exists, so a concurrent upload of the same bytes cannot replace it
+        os.link(path, BLOB_PATH / digest)
+        existed = False
+    except FileExistsError:
+        existed = True
+    os.unlink(path)
+    return existed
+
+
+@timed
+def write_blob(stream: BinaryIO) -> tuple[str, bool]:
+    """Stream the data into the blob store, hashing it on the way.
+
+    Return the content hash and whether identical bytes were already stored.
+    """
+    path, digest = spool(stream)
+    return digest, add_blob(path, digest)
+
+
+def link_blob(digest: str, folder: Path, suffix: str) -> tuple[Path, bool]:
+    """Link the blob into the folder. Return the path of the link and whether it already existed."""
+    os.makedirs(folder, exist_ok=True)
+    path = folder / f"{digest[:HASH_SIZE]}{suffix}"
+    try:
+        os.link(BLOB_PATH / digest, path)
+        return path, False
+    except FileExistsError:
+        return path, True
+
+
+def unlink_blob(path: str | Path) -> None:
+    """Remove a link to a blob, and the blob itself once nothing links to it anymore.
+
+    A link that is gone already, e.g. by a removal that was cut short, is skipped, since its blob cannot be found.
+    """
+    path = Path(path)
+    try:
+        stat = os.stat(path)
+        path.unlink()
+    except FileNotFoundError:
+        return
+    if stat.st_nlink > 2:
+        return
+
+    for blob in BLOB_PATH.glob(f"{path.stem}*"):
+        if os.stat(blob).st_ino == stat.st_ino:
+            blob.unlink()
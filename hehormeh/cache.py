@@ -0,0 +1,184 @@
+"""Bounded caches of rendered pages and page fragments, invalidated whenever the data changes, and of hot files."""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from . import metrics
+from .config import HOT_FILE_CACHE_BYTES, HOT_FILE_MAX_BYTES, RENDER_CACHE_SIZE
+
+
+class RenderCache:
+    """The least recently used renders, keyed by everything they depend on except the data version.
+
+    The data version is tracked separately: once it changes, no entry can be hit again, so all of them are dropped.
+    """
+
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self._entries: OrderedDict[tuple, str] = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: tuple, version, render) -> str:
+        """Return the render of the key at the data version, calling `render` on a miss."""
+        with self.lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+
+            page = self._entries.get(key)
+            if page is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("hehormeh_render_cache_total", route=key[0], result="miss" if page is None else "hit")
+        if page is not None:
+            return page
+
+        # render outside of the lock, so a slow page does not hold up the hits of the others
+        page = render()
+        with self.lock:
+            if version == self._version:
+                self._entries[key] = page
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return page
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self.lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Return the hits, misses and size of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+class FileCache:
+    """The bytes of the least recently used files, bounded by their total size.
+
+    Files are checked by their modification time and size on every lookup. Concurrent misses of a file wait for a
+    single read of it, so a burst of requests for the same few files reads each of them once.
+    """
+
+    def __init__(self, max_bytes: int = HOT_FILE_CACHE_BYTES, max_file_bytes: int = HOT_FILE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[tuple[int, int], bytes]] = OrderedDict()
+        self._loading: dict[tuple[str, tuple[int, int]], Future] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0  # misses that waited for the read of another one
+
+    def get(self, path: str, stat: os.stat_result | None = None) -> bytes | None:
+        """Return the content of the file, None if it is too large to be cached. Raise OSError if it cannot be read."""
+        stat = os.stat(path) if stat is None else stat
+        signature = stat.st_mtime_ns, stat.st_size
+        if signature[1] > self.max_file_bytes:
+            return None
+
+        with self.lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                result = "hit"
+            else:
+                future = self._loading.get((path, signature))
+                is_reader = future is None
+                if is_reader:
+                    future = self._loading[path, signature] = Future()
+                    self.misses += 1
+                    result = "miss"
+                else:
+                    self.waits += 1
+                    result = "wait"
+        metrics.inc("hehormeh_file_cache_total", result=result)
+        if result == "hit":
+            return entry[1]
+        if not is_reader:
+            return future.result()
+
+        # read outside of the lock, so the hits of the other files are not held up
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as exc:
+            with self.lock:
+                del self._loading[path, signature]
+            future.set_exception(exc)
+            raise
+
+        with self.lock:
+            # stored before the read is done, so no lookup in between reads the file again
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[path] = signature, data
+            self.size += len(data)
+            evicted = 0
+            while self.size > self.max_bytes:
+                _, (_, evicted_data) = self._entries.popitem(last=False)
+                self.size -= len(evicted_data)
+                evicted += len(evicted_data)
+            del self._loading[path, signature]
+        future.set_result(data)
+        # the resident bytes are the read ones less the evicted ones
+        metrics.inc("hehormeh_file_cache_bytes_total", len(data), event="read")
+        metrics.inc("hehormeh_file_cache_bytes_total", evicted + (len(old[1]) if old else 0), event="evicted")
+        return data
+
+    def warm(self, paths: list[str]) -> int:
+        """Read the files that are missing, as long as they fit in the cache together. Return the bytes read."""
+        total, read = 0, 0
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            if total > self.max_bytes:
+                break
+            with self.lock:
+                entry = self._entries.get(path)
+            if entry is None or entry[0] != (stat.st_mtime_ns, stat.st_size):
+                try:
+                    read += len(self.get(path, stat) or b"")
+                except OSError:
+                    continue
+        return read
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        with self.lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        """Return the hits, misses, waits and resident bytes of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses + self.waits
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "files": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
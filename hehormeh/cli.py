@@ -1,10 +1,16 @@
 """Implements the command line interface for `hehormeh`."""
 
+import contextlib
 import os
-import subprocess
+import signal
+import socket
+import sys
+from pathlib import Path
 
 import click
 
+from .config import DB_PATH, MEME_DUMP_PATH, STAGE_FILE, Config, get_config, set_config
+
 variables_option = click.option(
     "-v",
     "--variable",
@@ -19,12 +25,176 @@ variables_option = click.option(
 @click.argument("year", type=str)
 @click.option("-p", "--port", type=int, default=5001, help="Port to run the server on")
 @click.option("-d", "--debug", type=bool, is_flag=True, help="Enable debug mode")
-def start_server(year: str, port: int, debug: bool) -> None:
+@click.option("--production", is_flag=True, help="Serve with waitress instead of the development server")
+@click.option("-w", "--workers", type=int, default=1, help="Number of worker processes in production mode")
+@click.option("-t", "--threads", type=int, default=32, help="Number of threads per worker in production mode")
+@click.option("--connection-limit", type=int, default=200, help="Maximum open connections per worker")
+@click.option("--backlog", type=int, default=1024, help="Maximum queued connections waiting to be accepted")
+@click.option("--keep-alive", type=int, default=120, help="Seconds before an idle connection is closed")
+def start_server(
+    year: str,
+    port: int,
+    debug: bool,
+    production: bool,
+    workers: int,
+    threads: int,
+    connection_limit: int,
+    backlog: int,
+    keep_alive: int,
+) -> None:
     """Start the server."""
-    app = __name__.replace("cli", "app")
-    cmd = f"flask --app {app} run --host=0.0.0.0"
-    cmd += f" --port={port}" if port else ""
-    cmd += " --debug" if debug else ""
+    settings = {}
+    if production and "MAX_EVENT_LISTENERS" not in os.environ:
+        # every open event stream holds a thread, so leave some for the other requests
+        settings["max_event_listeners"] = max(threads // 2, 1)
+    config = Config.from_env(year, **settings)
+
+    from . import images, ingest
+    from .app import create_app
+    from .nights import data_paths
+    from .state import SharedValues
+
+    # every night starts with uploading, but a restart by the development reloader keeps the stage
+    if os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+        for path in data_paths():
+            SharedValues(path / STAGE_FILE.name, {}).reset()
+    # uploads still in flight were lost with the threads of the previous server
+    ingest.reset()
+
+    if not production:
+        app = create_app(config)
+        app.run(host="0.0.0.0", port=port, debug=debug)
+        return
+
+    try:
+        from waitress import serve
+    except ImportError:
+        raise click.ClickException("The production mode needs waitress, install the `server` extra") from None
+
+    # workers share the listening socket and create the app only after forking, so none of its threads are lost
+    sock = socket.create_server(("0.0.0.0", port), backlog=backlog)
+    options = {
+        "threads": threads,
+        "connection_limit": connection_limit,
+        "backlog": backlog,
+        "channel_timeout": keep_alive,
+        "ident": "hehormeh",
+    }
+
+    def serve_worker():
+        # the pools of the worker are shut down on SIGTERM, their processes would outlive it otherwise
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+        try:
+            serve(create_app(config), sockets=[sock], **options)
+        finally:
+            ingest.shutdown()
+            images.shutdown()
+
+    if workers == 1:
+        serve_worker()
+        return
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker()
+            finally:
+                os._exit(1)
+        pids.append(pid)
+
+    click.echo(f"Serving on port {port} with {workers} workers of {threads} threads")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    try:
+        for pid in pids:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+        # the workers stop their pools first, so wait for them
+        for pid in pids:
+            with contextlib.suppress(ChildProcessError):
+                os.waitpid(pid, 0)
+
+
+db_dir_option = click.option(
+    "--db-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Directory with the CSV files, defaults to `db/`",
+)
+
+
+@click.command()
+@click.argument("year", type=str)
+@db_dir_option
+def import_db(year: str, db_dir: Path | None) -> None:
+    """Import the CSV files of an event into its SQLite database."""
+    from .state import StateStore
+
+    set_config(Config.from_env(year))
+    StateStore("sqlite").copy_from(StateStore("csv", db_dir or DB_PATH))
+    click.echo(f"Imported {db_dir or DB_PATH} into {get_config().sqlite_file}")
+
+
+@click.command()
+@click.argument("year", type=str)
+@db_dir_option
+def export_db(year: str, db_dir: Path | None) -> None:
+    """Export the SQLite database of an event to CSV files."""
+    from .state import StateStore
+
+    set_config(Config.from_env(year))
+    StateStore("csv", db_dir or DB_PATH).copy_from(StateStore("sqlite"))
+    click.echo(f"Exported {get_config().sqlite_file} to {db_dir or DB_PATH}")
+
+
+@click.command()
+@click.argument("year", type=str)
+@db_dir_option
+def archive(year: str, db_dir: Path | None) -> None:
+    """Archive the results of a night for the hall of fame, e.g. of a night before the archive was kept."""
+    from .archive import ARCHIVE
+    from .nights import Night, serve
+    from .utils import archive_night
+
+    night = Night(Config.from_env(year, db_path=db_dir or DB_PATH))
+    night.open()
+    try:
+        with serve(night):
+            archive_night()
+    finally:
+        night.close()
+    click.echo(f"Archived {year} to {ARCHIVE.path / year}")
+
+
+@click.command()
+@click.argument("folders", nargs=-1, type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("-w", "--workers", type=int, default=None, help="Number of worker processes, defaults to the CPU count")
+def index_memes(folders: tuple[Path, ...], workers: int | None) -> None:
+    """Hash the memes in FOLDERS of nights (`meme_dump/` by default) for the repost detection."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    import numpy as np
+
+    from .reposts import REPOSTS, Image, find_images, hash_thumbnails, thumbnail
+
+    if Image is None:
+        raise click.ClickException("Hashing the memes needs Pillow, install the `images` extra")
+
+    REPOSTS.refresh()
+    images = [path for folder in folders or [MEME_DUMP_PATH] for path in find_images(folder)]
+    images = [path for path in images if str(path) not in REPOSTS.hashes]
+    with ProcessPoolExecutor(workers) as pool:
+        thumbnails = list(pool.map(thumbnail, images, chunksize=16))
 
-    os.environ["YEAR"] = year
-    subprocess.run(cmd, shell=True)
+    # the thumbnails are hashed all at once
+    readable = [(path, pixels) for path, pixels in zip(images, thumbnails) if pixels is not None]
+    if readable:
+        hashes = hash_thumbnails(np.stack([pixels for _, pixels in readable]))
+        REPOSTS.add({str(path): value for (path, _), value in zip(readable, hashes)})
+    click.echo(f"Indexed {len(readable)} memes, {len(images) - len(readable)} could not be read")
@@ -1,7 +1,9 @@
-"""Useful constants and paths for the project."""
+"""Useful constants and paths for the project, and the configuration of a meme night."""
 
 import json
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
 
 ROOT_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / ".."
@@ -10,17 +12,143 @@ DB_PATH = ROOT_DIR / "db"
 VOTES_FILE = DB_PATH / "votes.csv"
 IP_TO_USER_FILE = DB_PATH / "ip_to_user.csv"
 USER_TO_IMAGE_FILE = DB_PATH / "user_to_image.csv"
+LOCK_FILE = DB_PATH / "db.lock"
+STAGE_FILE = DB_PATH / "stage.json"  # stage of the night, shared by all worker processes
+BLOB_PATH = DB_PATH / "blobs"  # must be on the same file system as `UPLOAD_PATH`, since uploads are hard links
+SPOOL_PATH = DB_PATH / "spool"  # uploads waiting for validation, moved into `BLOB_PATH` by renaming
+UPLOADS_FILE = DB_PATH / "uploads.json"  # status of the uploads being processed, shared by all worker processes
+VARIANTS_FILE = DB_PATH / "variants.json"  # count of the memes with generated variants, shared by all worker processes
+NIGHTS_PATH = DB_PATH / "nights"  # data of the nights hosted next to the configured one, in a folder per year
+HASH_INDEX_FILE = DB_PATH / "hashes.csv"  # perceptual hashes of the memes of all nights, for the repost detection
+MEME_DUMP_PATH = ROOT_DIR / "meme_dump"  # memes of past nights, by year and category
+ARCHIVE_PATH = DB_PATH / "archive"  # results of the nights whose winners were announced, in a folder per year
 
+LOG_COMPACT_ROWS = 1000  # compact a CSV file once its log has this many rows
+LOG_COMPACT_INTERVAL = 60  # seconds between background compactions
+
+STATIC_PATH = ROOT_DIR / "static"
+PRECOMPRESSED_EXTENSIONS = {".css", ".svg", ".js"}
 QR_CODE_IMAGE_FILE_NAME = "qr_code.svg"
-QR_CODE_IMAGE_SAVE_PATH = ROOT_DIR / "static" / QR_CODE_IMAGE_FILE_NAME
+QR_CODE_IMAGE_SAVE_PATH = STATIC_PATH / QR_CODE_IMAGE_FILE_NAME
 
-YEAR = os.environ["YEAR"]
-UPLOAD_PATH = Path("static") / YEAR
+X_ACCEL_REDIRECT_PREFIX = "/protected-static/"  # internal location of the static folder in the proxy
 
 TRASH_ID, TRASH_CATEGORY = -1, "trash"
-_CATEGORY_INFO = json.load(open(ROOT_DIR / "categories" / f"{YEAR}.json"))
-ID2CAT = {int(cat_id): cat for cat_id, cat in _CATEGORY_INFO.items()}
-ID2CAT_ALL = {**ID2CAT, TRASH_ID: TRASH_CATEGORY}
+
+EVENT_BUFFER_SIZE = 100  # recent events kept for clients that reconnect
+EVENT_HEARTBEAT = 15  # seconds between keep-alive comments on idle event streams
+SHARED_STATE_POLL = 1  # seconds between checks for changes made by other worker processes
+RENDER_CACHE_SIZE = 256  # rendered pages and fragments kept by every worker process
+HOT_FILE_CACHE_BYTES = 64 * 2**20  # bytes of memes kept in memory by every worker process
+HOT_FILE_MAX_BYTES = 8 * 2**20  # larger memes are always sent from the disk
+NIGHT_IDLE_TIMEOUT = 15 * 60  # seconds without requests before a hosted night is unloaded
 
 ALLOWED_IMG_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif"}
+MAX_IMAGE_PIXELS = 40_000_000  # larger images are refused, they would stall the pages that show them
+INGEST_WORKERS = 4  # threads validating and registering the spooled uploads
 HASH_SIZE = 8
+VOTE_RANGE = (0, 100)  # lowest and highest funny and cringe votes
+VOTE_PAGE_SIZE = 6  # memes per page of the vote form, the pages are loaded one at a time
+SCORING_MODES = ("sum", "zscore", "trimmed", "bootstrap")  # ways to give the awards, the first is the default
+TRIM_FRACTION = 0.1  # share of the lowest and of the highest votes of a meme left out of its trimmed mean
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_SEED = 0
+HALL_OF_FAME_SIZE = 10  # users and memes listed in the hall of fame
+HALL_OF_FAME_MIN_VOTES = 3  # memes with fewer votes are not ranked among the best of all years
+REPOST_MAX_DISTANCE = 6  # differing bits of the 64-bit perceptual hashes, up to which memes look the same
+
+DERIVATIVE_WIDTHS = (480, 960, 1600)  # widths of the resized variants of uploaded memes, ascending
+DERIVATIVE_FORMATS = ("webp", "jpeg")
+DERIVATIVE_WORKERS = 2
+
+
+class Config:
+    """Configuration of a meme night: the year with its categories, and the settings of the server."""
+
+    def __init__(
+        self,
+        year: str,
+        storage_backend: str = "csv",
+        sendfile_mode: str = "",
+        metrics_enabled: bool = False,
+        max_event_listeners: int = 500,
+        db_path: Path = DB_PATH,
+    ):
+        self.year = year
+        self.storage_backend = storage_backend  # "csv" or "sqlite"
+        self.sendfile_mode = sendfile_mode  # "", "x-sendfile" or "x-accel-redirect" behind a proxy
+        self.metrics_enabled = metrics_enabled  # served on /metrics to the host
+        self.max_event_listeners = max_event_listeners  # per process, each holds a server thread
+        self.db_path = db_path
+
+        self.sqlite_file = db_path / f"{year}.sqlite3"
+        self.upload_path = Path("static") / year
+        with open(ROOT_DIR / "categories" / f"{year}.json") as f:
+            self.id2cat = {int(cat_id): cat for cat_id, cat in json.load(f).items()}
+        self.id2cat_all = {**self.id2cat, TRASH_ID: TRASH_CATEGORY}
+
+    @classmethod
+    def from_env(cls, year: str | None = None, **settings) -> "Config":
+        """Read the configuration from the environment variables, overridden by the given settings."""
+        year = year or os.environ.get("YEAR")
+        if not year:
+            raise ValueError("The year of the meme night is not set, pass it or set `YEAR`!")
+
+        env_settings = {
+            "storage_backend": os.environ.get("STORAGE_BACKEND", "csv"),
+            "sendfile_mode": os.environ.get("SENDFILE_MODE", ""),
+            "metrics_enabled": os.environ.get("METRICS", "") not in ["", "0"],
+            "max_event_listeners": int(os.environ.get("MAX_EVENT_LISTENERS", 500)),
+        }
+        return cls(year, **{**env_settings, **settings})
+
+    def for_night(self, year: str) -> "Config":
+        """Return the configuration of another night hosted with the same settings, with its data in `NIGHTS_PATH`."""
+        return Config(
+            year,
+            storage_backend=self.storage_backend,
+            sendfile_mode=self.sendfile_mode,
+            metrics_enabled=self.metrics_enabled,
+            max_event_listeners=self.max_event_listeners,
+            db_path=NIGHTS_PATH / year,
+        )
+
+
+def night_exists(year: str) -> bool:
+    """Return whether the year has categories, i.e. whether its night can be served."""
+    return (ROOT_DIR / "categories" / f"{year}.json").is_file()
+
+
+_CONFIG: Config | None = None
+_NIGHT_CONFIG: ContextVar[Config | None] = ContextVar("night_config", default=None)
+
+
+def get_main_config() -> Config:
+    """Return the configuration of the app, read from the environment if none was set."""
+    global _CONFIG
+
+    if _CONFIG is None:
+        _CONFIG = Config.from_env()
+    return _CONFIG
+
+
+def get_config() -> Config:
+    """Return the configuration of the night being served, which is the one of the app outside of other nights."""
+    return _NIGHT_CONFIG.get() or get_main_config()
+
+
+def set_config(config: Config) -> None:
+    """Set the configuration of the app."""
+    global _CONFIG
+
+    _CONFIG = config
+
+
+@contextmanager
+def use_config(config: Config):
+    """Serve the night of the configuration within the context, in this thread only."""
+    token = _NIGHT_CONFIG.set(config)
+    try:
+        yield config
+    finally:
+        _NIGHT_CONFIG.reset(token)
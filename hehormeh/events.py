@@ -0,0 +1,62 @@
+"""Server-sent events pushing stage changes, voting progress and award reveals to the clients."""
+
+import json
+import threading
+from collections import deque
+
+from .config import EVENT_BUFFER_SIZE, EVENT_HEARTBEAT, get_config
+
+
+class EventBroker:
+    """Fan-out of events to all listeners, with a buffer of recent events for reconnecting clients.
+
+    Idle listeners sleep on a condition variable until an event is published or the heartbeat is due.
+    """
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE, max_listeners: int | None = None):
+        self._condition = threading.Condition()
+        self._events: deque[tuple[int, str, str]] = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._max_listeners = max_listeners  # from the configuration, if not given
+        self.n_listeners = 0
+
+    def publish(self, name: str, data: dict) -> None:
+        """Send an event to all listeners."""
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, name, json.dumps(data)))
+            self._condition.notify_all()
+
+    def register(self) -> bool:
+        """Reserve a slot for a new listener. Return False if there are too many listeners already."""
+        with self._condition:
+            if self.n_listeners >= (self._max_listeners or get_config().max_event_listeners):
+                return False
+            self.n_listeners += 1
+            return True
+
+    def release(self) -> None:
+        """Give back the slot of a listener, once its stream is closed."""
+        with self._condition:
+            self.n_listeners -= 1
+
+    def listen(self, last_id: int | None = None, heartbeat: float = EVENT_HEARTBEAT):
+        """Yield events published after `last_id` in the SSE wire format, forever.
+
+        Needs a slot from `register`, which the caller gives back with `release` even if the stream never started.
+        """
+        with self._condition:
+            # a client may come back with an ID from before a restart of the server
+            last_id = self._last_id if last_id is None or last_id > self._last_id else last_id
+        yield f"retry: 3000\nid: {last_id}\n\n"
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._last_id > last_id, timeout=heartbeat)
+                events = [event for event in self._events if event[0] > last_id]
+
+            if not events:
+                yield ": heartbeat\n\n"
+            for event_id, name, data in events:
+                last_id = event_id
+                yield f"id: {event_id}\nevent: {name}\ndata: {data}\n\n"
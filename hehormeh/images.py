@@ -0,0 +1,128 @@
+"""Resized variants of the uploaded memes, generated in the background."""
+
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .config import DERIVATIVE_FORMATS, DERIVATIVE_WIDTHS, DERIVATIVE_WORKERS, ROOT_DIR, VARIANTS_FILE
+from .state import SharedValues
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # variants are optional, pages fall back to the originals
+    Image = ImageOps = None
+
+VARIANTS_DIR = "variants"
+_POOL = None
+_POOL_LOCK = threading.Lock()
+# pages cached by any worker process have to show the variants generated by any other
+_GENERATION = SharedValues(VARIANTS_FILE, {"generation": 0})
+
+
+def variant_path(image_path: str | Path, width: int, fmt: str) -> Path:
+    """Return the path of a variant of the image, relative like the image path."""
+    image_path = Path(image_path)
+    return image_path.parent / VARIANTS_DIR / f"{image_path.stem}_{width}.{fmt}"
+
+
+def generate_variants(image_path: str | Path) -> list[Path]:
+    """Write width-bounded variants of the image without EXIF data, for the widths below the width of the image.
+
+    A variant would be no smaller than the original for the other widths, which the pages offer instead.
+    """
+    image_path = ROOT_DIR / image_path
+    written = []
+    with Image.open(image_path) as img:
+        if getattr(img, "is_animated", False):
+            return written  # keep animated GIFs as they are
+
+        # bake the orientation into the pixels, since the EXIF data is not copied to the variants
+        img = ImageOps.exif_transpose(img)
+        os.makedirs(image_path.parent / VARIANTS_DIR, exist_ok=True)
+        for width in DERIVATIVE_WIDTHS:
+            if width >= img.width:
+                break
+            resized = img.resize((width, round(img.height * width / img.width)), Image.Resampling.LANCZOS)
+            for fmt in DERIVATIVE_FORMATS:
+                out = resized.convert("RGB") if fmt == "jpeg" else resized
+                path = variant_path(image_path, width, fmt)
+                # write under a temporary name, so pages never pick up a half-written variant
+                tmp_path = path.with_name(f".{path.name}")
+                out.save(tmp_path, format=fmt, quality=80)
+                os.replace(tmp_path, path)
+                written.append(path)
+    return written
+
+
+def schedule_variants(image_path: str | Path) -> None:
+    """Generate the variants of the image in a process pool without waiting for them."""
+    global _POOL
+
+    if Image is None:
+        return
+
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS)
+        _POOL.submit(generate_variants, str(image_path)).add_done_callback(_count_generation)
+
+
+def shutdown() -> None:
+    """Stop the process pool once the variants being generated are written, so none of its processes is left."""
+    global _POOL
+
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def _count_generation(_future) -> None:
+    with _GENERATION.lock:
+        _GENERATION.update(generation=_GENERATION.get("generation") + 1)
+
+
+def variants_generation() -> tuple | None:
+    """Return a value that changes whenever any process finished generating the variants of an image."""
+    return _GENERATION.signature()
+
+
+def remove_variants(image_path: str | Path) -> None:
+    """Remove all variants of the image."""
+    for width in DERIVATIVE_WIDTHS:
+        for fmt in DERIVATIVE_FORMATS:
+            Path(ROOT_DIR / variant_path(image_path, width, fmt)).unlink(missing_ok=True)
+
+
+@functools.lru_cache(maxsize=4096)
+def image_size(image_path: str | Path) -> tuple[int, int] | None:
+    """Return the width and height of an image, read from its header. None without Pillow or if it is unreadable.
+
+    Memes are named by their content hash, so their size never changes.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(ROOT_DIR / image_path) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def srcset(image_path: str | Path, fmt: str) -> str:
+    """Return the `srcset` attribute of the variants in the format that are ready, empty if there are none.
+
+    An original narrower than the largest width is offered with its width too, in place of the widths it has no
+    variants for, since the browsers ignore `src` next to a `srcset` with widths.
+    """
+    candidates = []
+    for width in DERIVATIVE_WIDTHS:
+        path = variant_path(image_path, width, fmt)
+        if os.path.exists(ROOT_DIR / path):
+            candidates.append(f"/{path} {width}w")
+    size = image_size(image_path)
+    if candidates and size is not None and size[0] <= DERIVATIVE_WIDTHS[-1]:
+        candidates.append(f"/{image_path} {size[0]}w")
+    return ", ".join(candidates)
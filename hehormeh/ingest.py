@@ -0,0 +1,163 @@
+"""Ingestion of the uploads: accepted on the request thread, validated and registered by a pool of threads.
+
+Accepting an upload only streams it into `SPOOL_PATH`. A worker then checks that it is an image of an allowed format
+and size, moves it into the blob store and registers it. The status of the uploads in flight is kept in
+`UPLOADS_FILE` of the night, so every worker process can show it.
+"""
+
+import contextvars
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
+
+from .blobs import add_blob, link_blob, spool, unlink_blob
+from .config import INGEST_WORKERS, MAX_IMAGE_PIXELS, SPOOL_PATH, UPLOADS_FILE, get_config
+from .images import schedule_variants
+from .nights import current, data_paths
+from .reposts import index_upload
+from .state import DuplicateUploadError, SharedValues
+from .utils import add_uploads, get_category_uploads
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow, only the signature of the files is checked
+    Image = None
+
+IMAGE_SIGNATURES = {b"\x89PNG\r\n\x1a\n": ".png", b"\xff\xd8\xff": ".jpg", b"GIF87a": ".gif", b"GIF89a": ".gif"}
+PENDING, FAILED = "pending", "failed"
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+class InvalidImageError(ValueError):
+    """The uploaded file is not an image that can be shown."""
+
+
+def validate_image(path: Path) -> str:
+    """Check that the file is a PNG, JPEG or GIF image of an allowed size. Return the extension of its format."""
+    with open(path, "rb") as f:
+        header = f.read(8)
+    suffix = next((suffix for signature, suffix in IMAGE_SIGNATURES.items() if header.startswith(signature)), None)
+    if suffix is None:
+        raise InvalidImageError("This is not a PNG, JPEG or GIF image!")
+    if Image is None:
+        return suffix
+
+    try:
+        with Image.open(path) as img:
+            n_pixels = img.width * img.height
+            if n_pixels <= MAX_IMAGE_PIXELS:
+                if img.format == "JPEG":
+                    img.draft(img.mode, (img.width // 8, img.height // 8))  # all data is read, but scaled down
+                img.load()  # decode it, so truncated and corrupt files are caught
+    except Image.DecompressionBombError as e:
+        raise InvalidImageError(f"This image is too large, it may have at most {MAX_IMAGE_PIXELS:,} pixels!") from e
+    except Exception as e:
+        raise InvalidImageError("This image is corrupt!") from e
+    if n_pixels > MAX_IMAGE_PIXELS:
+        raise InvalidImageError(f"This image is too large, it may have at most {MAX_IMAGE_PIXELS:,} pixels!")
+    return suffix
+
+
+def register(username: str, path: Path, digest: str, cat_id: int) -> tuple[dict, Path, bool]:
+    """Validate a spooled upload, move it into the blob store and link it into its category folder.
+
+    Return the upload row, the path of the image and whether the image is new. The row is not written, so several
+    uploads can be written together with `add_uploads`, which rejects the memes another user uploaded already.
+    """
+    try:
+        suffix = validate_image(path)
+    except InvalidImageError:
+        path.unlink()
+        raise
+
+    add_blob(path, digest)
+    img_path, linked = link_blob(digest, get_config().upload_path / get_config().id2cat_all[cat_id], suffix)
+    return {"user": username, "cat_id": cat_id, "img_name": img_path.name}, img_path, not linked
+
+
+def discard(row: dict, img_path: Path, is_new: bool) -> None:
+    """Remove the image of an upload that was not written, unless another upload of the category links to it."""
+    # the upload of another user that was written first may use the image this upload linked
+    if is_new and not any(other["img_name"] == row["img_name"] for other in get_category_uploads(row["cat_id"])):
+        unlink_blob(img_path)
+
+
+def _process(job_id: str, path: Path, digest: str) -> None:
+    jobs = current().jobs
+    job = jobs.get(job_id)
+    try:
+        row, img_path, is_new = register(job["user"], path, digest, job["cat_id"])
+    except Exception as e:
+        path.unlink(missing_ok=True)
+        message = str(e) if isinstance(e, ValueError) else "This upload failed, please try again!"
+        jobs.update(**{job_id: {**job, "status": FAILED, "error": message}})
+        if not isinstance(e, ValueError):
+            raise
+        return
+
+    try:
+        add_uploads([row])
+    except Exception as e:
+        discard(row, img_path, is_new)
+        message = str(e) if isinstance(e, DuplicateUploadError) else "This upload failed, please try again!"
+        jobs.update(**{job_id: {**job, "status": FAILED, "error": message}})
+        if not isinstance(e, DuplicateUploadError):
+            raise
+        return
+
+    if is_new:
+        index_upload(img_path)  # before the job is done, so its page shows the upload with any look-alikes
+        schedule_variants(img_path)
+    jobs.remove(job_id)
+
+
+def accept(username: str, stream: BinaryIO, filename: str, cat_id: int) -> str:
+    """Spool an uploaded file and queue it for validation and registration. Return the ID of the upload."""
+    global _POOL
+
+    path, digest = spool(stream, SPOOL_PATH)
+    job_id = uuid.uuid4().hex
+    jobs = current().jobs
+    with jobs.lock:
+        # a new upload replaces the failures of the user in the category
+        failed = [
+            key
+            for key, job in jobs.values().items()
+            if job["user"] == username and job["cat_id"] == cat_id and job["status"] == FAILED
+        ]
+        jobs.remove(*failed)
+        jobs.update(**{job_id: {"user": username, "cat_id": cat_id, "filename": filename, "status": PENDING}})
+
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+        # the worker registers the upload for the night being served now
+        _POOL.submit(contextvars.copy_context().run, _process, job_id, path, digest)
+    return job_id
+
+
+def user_jobs(username: str) -> list[dict]:
+    """Return the uploads of the user that are still being processed or that failed."""
+    return [job for job in current().jobs.values().values() if job["user"] == username]
+
+
+def shutdown() -> None:
+    """Stop the pool once the uploads being processed are registered. Queued uploads are left pending."""
+    global _POOL
+
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def reset() -> None:
+    """Forget all uploads in flight of all nights, e.g. of a server that was stopped before processing them."""
+    shutil.rmtree(SPOOL_PATH, ignore_errors=True)
+    for path in data_paths():
+        SharedValues(path / UPLOADS_FILE.name, {}).reset()
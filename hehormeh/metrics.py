@@ -0,0 +1,168 @@
+"""Opt-in instrumentation of the request handlers, the data functions and the storage, in the Prometheus text format.
+
+Nothing is recorded unless `init_app` enabled the metrics. Until then, no request hooks are installed and the only
+cost left is a flag check in `inc` and in the functions wrapped by `timed`.
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+from .config import get_config
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "hehormeh_request_duration_seconds": "Time spent handling requests, per route",
+    "hehormeh_requests_total": "Handled requests, per route and status",
+    "hehormeh_function_duration_seconds": "Time spent in the data functions",
+    "hehormeh_storage_loads_total": "Loads of a table from the storage",
+    "hehormeh_storage_rows_read_total": "Rows read from the storage",
+    "hehormeh_storage_bytes_read_total": "Bytes of CSV files and logs read from the storage",
+    "hehormeh_storage_writes_total": "Durable writes to the storage",
+    "hehormeh_storage_rows_written_total": "Rows written to the storage",
+    "hehormeh_storage_compactions_total": "Compactions of a table",
+    "hehormeh_render_cache_total": "Lookups in the render cache, per route and result",
+    "hehormeh_file_cache_total": "Lookups in the cache of hot memes, per result",
+    "hehormeh_file_cache_bytes_total": "Bytes read into and evicted from the cache of hot memes",
+}
+
+
+class Histogram:
+    """Counts of observed values in cumulative buckets, with their sum and maximum."""
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Count a value in the first bucket that is not below it."""
+        self.bucket_counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+def _format_labels(labels: tuple) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+
+class Registry:
+    """Counters and histograms, keyed by metric name and a sorted tuple of label items."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Increase a counter."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Add a value to a histogram."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.histograms.setdefault(name, {}).setdefault(key, Histogram()).observe(value)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines += [f"# HELP {name} {HELP[name]}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in series.items()]
+
+            for name, series in sorted(self.histograms.items()):
+                lines += [f"# HELP {name} {HELP[name]}", f"# TYPE {name} histogram"]
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip([*map(str, BUCKETS), "+Inf"], histogram.bucket_counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels((*labels, ('le', bound)))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict[str, list[dict]]:
+        """Return the histograms as rows with count, mean and maximum in milliseconds, and the counters."""
+        with self.lock:
+            summary = {
+                name: [
+                    {
+                        **dict(labels),
+                        "count": histogram.count,
+                        "mean_ms": round(histogram.sum / histogram.count * 1000, 2),
+                        "max_ms": round(histogram.max * 1000, 2),
+                    }
+                    for labels, histogram in sorted(series.items())
+                ]
+                for name, series in self.histograms.items()
+            }
+            summary["counters"] = [
+                {"name": f"{name}{_format_labels(labels)}", "value": value}
+                for name, series in sorted(self.counters.items())
+                for labels, value in sorted(series.items())
+            ]
+        return summary
+
+
+REGISTRY = Registry()
+ENABLED = False
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Increase a counter, if metrics are enabled."""
+    if ENABLED:
+        REGISTRY.inc(name, value, **labels)
+
+
+def timed(func):
+    """Record the duration of the calls of the function, if metrics are enabled."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            REGISTRY.observe("hehormeh_function_duration_seconds", time.perf_counter() - start, function=func.__name__)
+
+    return wrapper
+
+
+def init_app(app) -> None:
+    """Enable the metrics if they are enabled in the configuration, and time all requests of the app."""
+    global ENABLED
+
+    if not get_config().metrics_enabled:
+        return
+
+    from flask import g, request
+
+    ENABLED = True
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        REGISTRY.observe(
+            "hehormeh_request_duration_seconds",
+            time.perf_counter() - g.request_start,
+            method=request.method,
+            route=route,
+        )
+        REGISTRY.inc("hehormeh_requests_total", method=request.method, route=route, status=response.status_code)
+        return response
@@ -0,0 +1,151 @@
+"""The meme nights served by the app, each with its own categories, data, stage, uploads in flight and clients.
+
+The night of the configuration is served under `/`, the others under `/e/<year>/` with their data in `NIGHTS_PATH`.
+A night is loaded by its first request and unloaded again once it was idle for `NIGHT_IDLE_TIMEOUT`, except for the
+night of the configuration. Code that runs for a night finds it with `current`, within `serve`.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from .cache import RenderCache
+from .config import (
+    DB_PATH,
+    NIGHT_IDLE_TIMEOUT,
+    NIGHTS_PATH,
+    STAGE_FILE,
+    UPLOADS_FILE,
+    Config,
+    get_main_config,
+    night_exists,
+    use_config,
+)
+from .events import EventBroker
+from .state import SharedValues, StateStore
+
+
+class Night:
+    """The state of a meme night in this worker process."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.state = StateStore(config.storage_backend, config.db_path)
+        # the stage and the category being voted on are shared by all worker processes, `hehormeh-start` resets them
+        self.shared = SharedValues(config.db_path / STAGE_FILE.name, {"stage": "UPLOAD"})
+        self.jobs = SharedValues(config.db_path / UPLOADS_FILE.name, {})  # uploads being processed
+        self.events = EventBroker(max_listeners=config.max_event_listeners)
+        self.render_cache = RenderCache()
+        self.scoreboard_cache: dict[tuple[int, str], tuple[dict, dict, dict]] = {}  # by score epoch and scoring mode
+        self.last_progress = None  # voting progress last told to the clients
+        self.watched_version = None  # data version last seen by the watcher of other workers
+        self.last_used = time.monotonic()
+
+    @property
+    def year(self) -> str:
+        """Return the year of the night."""
+        return self.config.year
+
+    def open(self) -> None:
+        """Load the data and start compacting it in the background."""
+        self.config.db_path.mkdir(parents=True, exist_ok=True)
+        with serve(self):
+            self.state.load()
+            self.state.start_compactor()
+            self.watched_version = self.state.data_version()
+
+    def close(self) -> None:
+        """Stop the background threads of the data, once it is written."""
+        with serve(self):
+            self.state.close()
+
+    def is_idle(self, timeout: float) -> bool:
+        """Return whether the night had no requests for the timeout, and has no clients or uploads waiting."""
+        return (
+            time.monotonic() - self.last_used > timeout
+            and self.events.n_listeners == 0
+            and not any(job["status"] == "pending" for job in self.jobs.values().values())  # see `ingest.PENDING`
+        )
+
+
+class Nights:
+    """The nights loaded by this worker process, by year."""
+
+    def __init__(self, idle_timeout: float = NIGHT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self._nights: dict[str, Night] = {}
+
+    def main(self) -> Night:
+        """Return the night of the configuration of the app."""
+        return self.get(get_main_config().year)
+
+    def get(self, year: str) -> Night:
+        """Return the night of the year, loading it on first use. Raise KeyError if there is no such night."""
+        main_config = get_main_config()
+        with self.lock:
+            night = self._nights.get(year)
+            if night is not None and year == main_config.year and night.config is not main_config:
+                night.close()  # the app was configured anew
+                night = None
+            if night is None:
+                if year == main_config.year:
+                    night = Night(main_config)
+                elif night_exists(year):
+                    night = Night(main_config.for_night(year))
+                else:
+                    raise KeyError(year)
+                night.open()
+                self._nights[year] = night
+            night.last_used = time.monotonic()
+            return night
+
+    def loaded(self) -> list[Night]:
+        """Return the nights that are loaded."""
+        with self.lock:
+            return list(self._nights.values())
+
+    def n_listeners(self) -> int:
+        """Return the number of event streams open on all nights, each of which holds a thread."""
+        return sum(night.events.n_listeners for night in self.loaded())
+
+    def evict_idle(self) -> list[Night]:
+        """Unload the nights that have been idle for too long, except for the one of the configuration."""
+        main_year = get_main_config().year
+        with self.lock:
+            idle = [
+                night for year, night in self._nights.items() if year != main_year and night.is_idle(self.idle_timeout)
+            ]
+            for night in idle:
+                del self._nights[night.year]
+        for night in idle:
+            night.close()
+        return idle
+
+
+def data_paths() -> list[Path]:
+    """Return the folders with the data of the configured night and of the other nights served so far."""
+    return [DB_PATH, *sorted(path for path in NIGHTS_PATH.glob("*") if path.is_dir())]
+
+
+NIGHTS = Nights()
+_CURRENT: ContextVar[Night | None] = ContextVar("night", default=None)
+
+
+def current() -> Night:
+    """Return the night being served, which is the one of the configuration outside of `serve`."""
+    night = _CURRENT.get()
+    return night if night is not None else NIGHTS.main()
+
+
+@contextmanager
+def serve(night: Night):
+    """Serve the night within the context, so `current` and `get_config` return it."""
+    token = _CURRENT.set(night)
+    try:
+        with use_config(night.config):
+            yield night
+    finally:
+        _CURRENT.reset(token)
@@ -0,0 +1,203 @@
+"""Detection of reposts: memes that look like memes of other nights, uploaded before or collected in `meme_dump/`.
+
+Every meme is fingerprinted by its difference hash, 64 bits that hardly change when the image is resized or
+recompressed. The hashes are appended to `HASH_INDEX_FILE`, shared by all worker processes and nights, and searched
+by their Hamming distance with a BK-tree.
+"""
+
+import csv
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .config import ALLOWED_IMG_EXTENSIONS, HASH_INDEX_FILE, REPOST_MAX_DISTANCE, ROOT_DIR
+from .images import VARIANTS_DIR
+from .metrics import timed
+from .storage import LOG_DELETE, LOG_UPSERT, file_lock
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow, no reposts are detected
+    Image = None
+
+if TYPE_CHECKING:  # the data stack is imported on first use, to keep the startup fast
+    import numpy as np
+
+HASH_WIDTH, HASH_HEIGHT = 9, 8  # a row of 9 pixels has 8 differences, so 8 rows make 64 bits
+
+
+def thumbnail(image_path: str | Path) -> "np.ndarray | None":
+    """Return the grayscale thumbnail of the image that is hashed, None if it cannot be read."""
+    import numpy as np
+
+    try:
+        with Image.open(ROOT_DIR / image_path) as img:
+            img.draft("L", (HASH_WIDTH * 8, HASH_HEIGHT * 8))  # JPEGs are decoded at a fraction of their size
+            small = img.convert("L").resize((HASH_WIDTH, HASH_HEIGHT), Image.Resampling.BILINEAR)
+            return np.asarray(small, dtype=np.int16)
+    except Exception:
+        return None
+
+
+def hash_thumbnails(thumbnails: "np.ndarray") -> list[int]:
+    """Return the difference hashes of a stack of thumbnails: a bit per pixel that is brighter than its left one."""
+    import numpy as np
+
+    bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    return np.packbits(bits.reshape(len(thumbnails), -1), axis=1).view(">u8").ravel().tolist()
+
+
+def dhash(image_path: str | Path) -> int | None:
+    """Return the difference hash of the image, None if it cannot be read or Pillow is missing."""
+    if Image is None:
+        return None
+    pixels = thumbnail(image_path)
+    return None if pixels is None else hash_thumbnails(pixels[None])[0]
+
+
+def night_of(image_path: str | Path) -> str:
+    """Return the night of a meme, named by the folder of its category like `static/<year>/<category>/<meme>`."""
+    return Path(image_path).parts[-3]
+
+
+class BKTree:
+    """Metric tree of hashes under the Hamming distance, which finds the hashes within a small distance quickly.
+
+    The children of a node are keyed by their distance to it, so the triangle inequality prunes most subtrees.
+    """
+
+    def __init__(self):
+        self._root = None  # [hash, items, children by distance]
+
+    def add(self, value: int, item) -> None:
+        """Add an item with the hash."""
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            if distance not in node[2]:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = node[2][distance]
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, object]]:
+        """Return the items with hashes within the distance, with their distance."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = (node_value ^ value).bit_count()
+            if distance <= max_distance:
+                found.extend((distance, item) for item in items)
+            stack.extend(
+                child for child_distance, child in children.items() if abs(child_distance - distance) <= max_distance
+            )
+        return found
+
+
+class RepostIndex:
+    """The hashes of the memes of all nights, by the path of the meme.
+
+    The index file is a log that is only appended to, so other processes are caught up by reading its new lines.
+    Removed memes stay in the tree, but are skipped by the searches.
+    """
+
+    def __init__(self, path: Path = HASH_INDEX_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file_lock = file_lock(path.with_suffix(".lock"))
+        self.hashes: dict[str, int] = {}
+        self._tree = BKTree()
+        self._offset = 0
+
+    def signature(self) -> int:
+        """Return a value that changes whenever a meme is indexed or removed, by any process."""
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def refresh(self) -> None:
+        """Read the lines appended since the last refresh."""
+        with self.lock, self.file_lock:
+            if self.signature() == self._offset:
+                return
+            with open(self.path, newline="") as f:
+                f.seek(self._offset)
+                for op, path, value in csv.reader(f):
+                    self._apply(op, path, int(value, 16) if value else None)
+                self._offset = f.tell()
+
+    def _apply(self, op: str, path: str, value: int | None) -> None:
+        if op == LOG_DELETE:
+            self.hashes.pop(path, None)
+        elif self.hashes.get(path) != value:
+            self.hashes[path] = value
+            self._tree.add(value, path)
+
+    def _append(self, records: list[tuple[str, str, int | None]]) -> None:
+        os.makedirs(self.path.parent, exist_ok=True)
+        with self.file_lock, open(self.path, "a", newline="") as f:
+            csv.writer(f).writerows((op, path, "" if value is None else f"{value:016x}") for op, path, value in records)
+
+    def add(self, hashes: dict[str, int]) -> None:
+        """Index the memes by their path."""
+        self._append([(LOG_UPSERT, path, value) for path, value in hashes.items()])
+        self.refresh()
+
+    def remove(self, path: str | Path) -> None:
+        """Remove a meme from the index."""
+        if str(path) in self.hashes:
+            self._append([(LOG_DELETE, str(path), None)])
+            self.refresh()
+
+    @timed
+    def matches(self, image_path: str | Path, max_distance: int = REPOST_MAX_DISTANCE) -> list[str]:
+        """Return the memes of other nights that look like the meme, the most similar first."""
+        self.refresh()
+        with self.lock:
+            value = self.hashes.get(str(image_path))
+            if value is None:
+                return []
+            night = night_of(image_path)
+            found = sorted(
+                (distance, path)
+                for distance, path in self._tree.search(value, max_distance)
+                if self.hashes.get(path) is not None
+                and (self.hashes[path] ^ value).bit_count() == distance  # not an old hash of a re-indexed path
+                and night_of(path) != night
+            )
+        return list(dict.fromkeys(path for _, path in found))
+
+
+REPOSTS = RepostIndex()
+
+
+def index_upload(image_path: str | Path) -> None:
+    """Hash an uploaded meme and add it to the index."""
+    value = dhash(image_path)
+    if value is not None:
+        REPOSTS.add({str(image_path): value})
+
+
+def find_images(folder: str | Path) -> list[Path]:
+    """Return the memes in a folder laid out like `<folder>/<year>/<category>/<meme>`, relative to `ROOT_DIR`.
+
+    Memes outside of `ROOT_DIR` keep their absolute path.
+    """
+    folder, root_dir = Path(os.path.abspath(folder)), Path(os.path.abspath(ROOT_DIR))
+    images = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(name for name in dirs if name != VARIANTS_DIR)  # resized copies of the uploads
+        for name in sorted(files):
+            path = Path(root) / name
+            if path.suffix.lower() in ALLOWED_IMG_EXTENSIONS and len(path.relative_to(folder).parts) == 3:
+                images.append(path.relative_to(root_dir) if path.is_relative_to(root_dir) else path)
+    return images
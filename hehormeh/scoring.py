@@ -0,0 +1,153 @@
+"""Scoring of the memes and their authors on a dense voter×meme matrix of the votes.
+
+Besides the plain sums of `ScoreAggregates`, the awards can be given by
+ - `zscore`: the mean of the votes, each normalized by the mean and spread of its voter, so generous voters count
+   as much as strict ones,
+ - `trimmed`: the mean of the votes without the most extreme ones on either side,
+ - `bootstrap`: the memes and authors that win an award most often when the voters are resampled, with that share
+   as the confidence in the award.
+"""
+
+import numpy as np
+
+from .config import BOOTSTRAP_RESAMPLES, BOOTSTRAP_SEED, TRIM_FRACTION
+
+PLANES = ("funny", "cringe")
+
+
+class VoteMatrix:
+    """The funny and cringe votes of every voter for every meme that got a vote, and the authors of the memes.
+
+    Missing votes are masked out. Votes that authors gave to their own memes and votes for memes that are gone are
+    left out, so every meme has at least one vote.
+    """
+
+    def __init__(self, votes: dict[str, list], uploads: dict[str, list]):
+        # the users and the memes are numbered by sorting them, so ties go to the smallest key like with the sums
+        users, user_idx = np.unique(np.array(votes["user"] + uploads["user"], dtype=object), return_inverse=True)
+        vote_user, upload_user = np.split(user_idx.ravel(), [len(votes["user"])])
+        meme_keys = sorted(
+            set(zip(uploads["cat_id"], uploads["img_name"])) | set(zip(votes["cat_id"], votes["img_name"]))
+        )
+        meme_pos = {key: pos for pos, key in enumerate(meme_keys)}
+        vote_meme = np.fromiter(
+            map(meme_pos.__getitem__, zip(votes["cat_id"], votes["img_name"])), dtype=np.intp, count=len(vote_user)
+        )
+        author = np.full(len(meme_keys), -1)
+        author[[meme_pos[key] for key in zip(uploads["cat_id"], uploads["img_name"])]] = upload_user
+
+        keep = (author[vote_meme] >= 0) & (author[vote_meme] != vote_user)
+        voters, voter_idx = np.unique(vote_user[keep], return_inverse=True)
+        memes, meme_idx = np.unique(vote_meme[keep], return_inverse=True)
+        self.voters = users[voters]
+        self.memes = [meme_keys[pos] for pos in memes.tolist()]
+
+        shape = (len(self.voters), len(self.memes))
+        self.mask = np.zeros(shape, dtype=bool)
+        self.mask[voter_idx, meme_idx] = True
+        self.planes = {}
+        for plane in PLANES:
+            self.planes[plane] = np.zeros(shape)
+            self.planes[plane][voter_idx, meme_idx] = np.asarray(votes[plane], dtype=float)[keep]
+
+        authors, author_idx = np.unique(author[memes], return_inverse=True)
+        self.authors = users[authors]
+        # averages the scores of the memes of every author by a product with the scores
+        self.author_weights = np.zeros((len(self.memes), len(self.authors)))
+        self.author_weights[np.arange(len(self.memes)), author_idx] = 1
+        self.author_weights /= np.maximum(self.author_weights.sum(axis=0), 1)
+
+    def zscores(self) -> dict[str, np.ndarray]:
+        """Return the votes normalized per voter, masked votes are 0."""
+        counts = self.mask.sum(axis=1, keepdims=True)
+        normalized = {}
+        for plane, values in self.planes.items():
+            mean = values.sum(axis=1, keepdims=True) / np.maximum(counts, 1)
+            deviations = np.where(self.mask, values - mean, 0.0)
+            std = np.sqrt((deviations**2).sum(axis=1, keepdims=True) / np.maximum(counts, 1))
+            # a voter who gives every meme the same score has no preference between them
+            normalized[plane] = np.divide(deviations, std, out=np.zeros_like(deviations), where=std > 0)
+        return normalized
+
+    def trimmed_means(self, fraction: float = TRIM_FRACTION) -> dict[str, np.ndarray]:
+        """Return the mean votes per meme without the `fraction` of the lowest and of the highest votes."""
+        counts = self.mask.sum(axis=0)
+        trim = np.floor(counts * fraction).astype(int)
+        means = {}
+        for plane, values in self.planes.items():
+            # the masked votes are sorted to the end, so the kept votes of a meme are rows trim..counts-trim
+            ordered = np.sort(np.where(self.mask, values, np.inf), axis=0)
+            cumsum = np.vstack([np.zeros(len(self.memes)), np.cumsum(np.where(np.isinf(ordered), 0, ordered), axis=0)])
+            cols = np.arange(len(self.memes))
+            kept = cumsum[counts - trim, cols] - cumsum[trim, cols]
+            means[plane] = kept / np.maximum(counts - 2 * trim, 1)
+        return means
+
+    def author_means(self, meme_scores: np.ndarray) -> np.ndarray:
+        """Return the mean score of the memes of every author, along the last axis."""
+        return meme_scores @ self.author_weights
+
+    def meme_means(self, values: dict[str, np.ndarray], weights: np.ndarray | None = None) -> dict[str, np.ndarray]:
+        """Return the mean of the votes per meme, weighting the voters by `weights` of shape (resamples, voters)."""
+        if weights is None:
+            weights = np.ones((1, len(self.voters)))
+        # a single product of floats for the counts and all planes, which numpy hands to BLAS
+        stacked = np.hstack([self.mask, *values.values()]).astype(float)
+        sums = np.split(weights.astype(float) @ stacked, len(values) + 1, axis=1)
+        counts = sums[0]
+        return {
+            plane: np.divide(plane_sums, counts, out=np.full(counts.shape, np.nan), where=counts > 0)
+            for plane, plane_sums in zip(values, sums[1:])
+        }
+
+    def scores(self, mode: str) -> tuple[dict, dict]:
+        """Return the (funny, cringe) scores per meme and per author of the mode, in the form of the sums."""
+        if mode == "trimmed":
+            meme_scores = self.trimmed_means()
+        else:
+            meme_scores = {plane: means[0] for plane, means in self.meme_means(self.zscores()).items()}
+        author_scores = {plane: self.author_means(scores) for plane, scores in meme_scores.items()}
+        return (
+            dict(zip(self.memes, zip(*(meme_scores[plane].tolist() for plane in PLANES)))),
+            dict(zip(self.authors.tolist(), zip(*(author_scores[plane].tolist() for plane in PLANES)))),
+        )
+
+    def bootstrap(
+        self, awards: list[tuple[str, str, str]], by_author: bool, n_resamples: int = BOOTSTRAP_RESAMPLES
+    ) -> dict[str, dict]:
+        """Resample the voters and give every award to the meme or author that wins it most often.
+
+        Return the winner of every award, the share of resamples it won and the 90% interval of its score.
+        """
+        if not len(self.voters) or not len(self.memes):
+            return {}
+
+        # the same seed in every worker process, so they all announce the same winners
+        rng = np.random.default_rng(BOOTSTRAP_SEED)
+        weights = rng.multinomial(len(self.voters), np.full(len(self.voters), 1 / len(self.voters)), size=n_resamples)
+        zscores = self.zscores()
+        full = self.meme_means(zscores)
+        scores = {}
+        for plane, means in self.meme_means(zscores, weights).items():
+            # a meme whose voters all fell out of a resample keeps its score of all voters
+            means = np.where(np.isnan(means), full[plane], means)
+            scores[plane] = self.author_means(means) if by_author else means
+        scores["both"] = scores["funny"] + scores["cringe"]
+        keys = self.authors.tolist() if by_author else self.memes
+
+        results = {}
+        for name, col, func in awards:
+            values = scores[col]
+            if func == "median":
+                middle = values.shape[1] // 2
+                winners = np.argpartition(values, middle, axis=1)[:, middle]
+            else:
+                winners = np.argmax(values, axis=1)
+            winner = int(np.argmax(np.bincount(winners, minlength=values.shape[1])))
+            low, high = np.percentile(values[:, winner], [5, 95])
+            results[name] = {
+                "winner": keys[winner],
+                "share": round(float(np.mean(winners == winner)), 3),
+                "interval": (round(float(low), 2), round(float(high), 2)),
+            }
+        return results
@@ -0,0 +1,171 @@
+"""Cache-aware serving of the static files and the uploaded memes."""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from pathlib import Path
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+from .cache import FileCache
+from .config import (
+    DERIVATIVE_FORMATS,
+    DERIVATIVE_WIDTHS,
+    HASH_SIZE,
+    PRECOMPRESSED_EXTENSIONS,
+    ROOT_DIR,
+    STATIC_PATH,
+    X_ACCEL_REDIRECT_PREFIX,
+    get_config,
+    night_exists,
+)
+from .images import variant_path
+
+try:
+    import brotli
+except ImportError:  # only gzip then
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+_VERSIONS: dict[Path, tuple[tuple[int, int], str]] = {}
+HOT_FILES = FileCache()  # the memes of the category on screen, requested by all clients at once
+
+
+def static_version(filename: str) -> str | None:
+    """Return a short content hash of the static file, to version its URL. None if there is no such file."""
+    path = STATIC_PATH / filename
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if path not in _VERSIONS or _VERSIONS[path][0] != signature:
+        _VERSIONS[path] = signature, hashlib.sha256(path.read_bytes()).hexdigest()[:HASH_SIZE]
+    return _VERSIONS[path][1]
+
+
+def is_meme(filename: str) -> bool:
+    """Check if the static file is an uploaded meme or its variant, which are named by their content hash."""
+    # the memes of every night are in the folder of its year, like `Config.upload_path`
+    parts = Path(filename).parts
+    return len(parts) > 1 and night_exists(parts[0])
+
+
+def precompress(path: Path) -> None:
+    """Write gzip and, if available, brotli compressed copies next to the file, unless they are up to date."""
+    data = None
+    for encoding, suffix in ENCODINGS:
+        if encoding == "br" and brotli is None:
+            continue
+
+        compressed_path = Path(f"{path}{suffix}")
+        if compressed_path.exists() and compressed_path.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+            continue
+
+        data = path.read_bytes() if data is None else data
+        compressed = brotli.compress(data) if encoding == "br" else gzip.compress(data, mtime=0)
+        tmp_path = compressed_path.with_name(f".{compressed_path.name}")
+        tmp_path.write_bytes(compressed)
+        os.replace(tmp_path, compressed_path)
+
+
+def precompress_static() -> None:
+    """Precompress all text assets in the static folder."""
+    for root, _, files in os.walk(STATIC_PATH):
+        for name in files:
+            if Path(name).suffix in PRECOMPRESSED_EXTENSIONS:
+                precompress(Path(root) / name)
+
+
+def serve_static(filename: str) -> Response:
+    """Serve a static file with an ETag, long-lived caching of versioned files and precompressed variants."""
+    path = safe_join(str(STATIC_PATH), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    encoding = None
+    is_compressible = Path(path).suffix in PRECOMPRESSED_EXTENSIONS
+    if is_compressible:
+        for name, suffix in ENCODINGS:
+            if name in request.accept_encodings and os.path.isfile(f"{path}{suffix}"):
+                encoding, path = name, f"{path}{suffix}"
+                break
+
+    # memes are named by their content hash, so the name is a strong validator
+    stat = os.stat(path)
+    etag = Path(filename).stem if is_meme(filename) else f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    etag = f"{etag}-{encoding}" if encoding else etag
+
+    if get_config().sendfile_mode == "x-accel-redirect":
+        response = Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = X_ACCEL_REDIRECT_PREFIX + os.path.relpath(path, STATIC_PATH)
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+    elif (data := _hot_file(filename, path, stat)) is not None:
+        response = Response(data, mimetype=mimetype)
+        response.last_modified = stat.st_mtime
+        response.set_etag(etag)
+        response = response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    else:
+        # with USE_X_SENDFILE set, the proxy reads the file instead of us
+        response = send_file(path, mimetype=mimetype, download_name=Path(filename).name, etag=etag, conditional=True)
+
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if is_compressible:
+        response.vary.add("Accept-Encoding")
+
+    # a stale or made-up version would pin the current content under its URL
+    if is_meme(filename) or ("v" in request.args and request.args["v"] == static_version(filename)):
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def _hot_file(filename: str, path: str, stat: os.stat_result) -> bytes | None:
+    """Return the content of a meme from the hot cache, None if it is sent from the disk."""
+    if get_config().sendfile_mode or not is_meme(filename):
+        return None
+    try:
+        return HOT_FILES.get(path, stat)
+    except OSError:
+        abort(404)
+
+
+def warm_memes(image_paths: list[str]) -> None:
+    """Read the memes and their variants into the hot cache in a background thread, before the clients ask for them."""
+    if get_config().sendfile_mode:
+        return
+
+    # the variants the pages offer first, so the originals are the ones left out if they do not all fit
+    paths = [
+        str(ROOT_DIR / variant_path(image_path, width, fmt))
+        for fmt in DERIVATIVE_FORMATS
+        for width in DERIVATIVE_WIDTHS
+        for image_path in image_paths
+    ]
+    paths.extend(str(ROOT_DIR / image_path) for image_path in image_paths)
+    threading.Thread(target=HOT_FILES.warm, args=(paths,), daemon=True).start()
+
+
+def init_app(app) -> None:
+    """Serve the static folder through `serve_static` and version the URLs built for it."""
+    app.config["USE_X_SENDFILE"] = get_config().sendfile_mode == "x-sendfile"
+    app.add_url_rule("/static/<path:filename>", endpoint="static", view_func=serve_static)
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        if endpoint == "static" and "v" not in values:
+            version = static_version(values["filename"])
+            if version:
+                values["v"] = version
+
+    precompress_static()
@@ -0,0 +1,831 @@
+"""In-memory state of the meme night, persisted to the CSV files or the SQLite database in `DB_PATH`."""
+
+import contextlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from itertools import compress
+from pathlib import Path
+
+from .config import (
+    DB_PATH,
+    IP_TO_USER_FILE,
+    LOCK_FILE,
+    LOG_COMPACT_INTERVAL,
+    LOG_COMPACT_ROWS,
+    USER_TO_IMAGE_FILE,
+    VOTES_FILE,
+    get_config,
+)
+from .storage import INT_COLUMNS, LOG_DELETE, LOG_UPSERT, CsvStorage, SqliteStorage, Storage, file_lock
+
+logger = logging.getLogger(__name__)
+
+
+class Table:
+    """Rows of a single table, kept in memory with last-write-wins semantics on the key columns.
+
+    The storage backend is only a persistence target. It is re-read only if it was changed by someone else.
+    """
+
+    def __init__(self, storage: Storage, columns: list[str], key_cols: list[str] | None = None):
+        self.storage = storage
+        self.columns = columns
+        self.key_cols = key_cols or columns
+        self._signature = None
+        self._clear()
+
+    @property
+    def log_rows(self) -> int:
+        """Return the number of changes not yet compacted."""
+        return self.storage.log_rows
+
+    def _key(self, row: Mapping) -> tuple:
+        return tuple(row[col] for col in self.key_cols)
+
+    def is_stale(self) -> bool:
+        """Check if the storage was changed since it was last loaded or written."""
+        return self.storage.signature() != self._signature
+
+    def load(self) -> None:
+        """Load all rows from the storage."""
+        self._clear()
+        for op, row in self.storage.load():
+            if op == LOG_UPSERT:
+                self._set(row)
+            else:
+                self._remove(row)
+        self._signature = self.storage.signature()
+
+    def persist(self, records: list[tuple[str, dict]]) -> None:
+        """Persist the `(op, row)` records returned by `upsert` and `delete`."""
+        self.storage.append(records)
+        self._signature = self.storage.signature()
+
+    def compact(self) -> None:
+        """Fold the pending changes into the canonical storage."""
+        self.storage.compact(self.values())
+        self._signature = self.storage.signature()
+
+    def _clear(self) -> None:
+        self.rows: dict[tuple, dict] = {}
+
+    def _set(self, row: dict) -> None:
+        """Insert the row at the end, replacing any row with the same key."""
+        key = self._key(row)
+        self.rows.pop(key, None)
+        self.rows[key] = row
+
+    def _remove(self, row: Mapping) -> None:
+        self.rows.pop(self._key(row), None)
+
+    def upsert(self, content: list[dict], check_cols: list[str] | None = None) -> list[tuple[str, dict]]:
+        """Add rows in memory, overwriting existing rows with the same values in `check_cols`."""
+        if (check_cols or self.columns) != self.key_cols:
+            raise ValueError(f"Rows of the table are identified by {self.key_cols}, not {check_cols}!")
+
+        content = [{col: row[col] for col in self.columns} for row in content]
+        for row in content:
+            self._set(row)
+        return [(LOG_UPSERT, row) for row in content]
+
+    def delete(self, predicate) -> list[tuple[str, dict]]:
+        """Remove all rows for which the predicate holds from memory."""
+        deleted = [dict(row) for row in self.values() if predicate(row)]
+        for row in deleted:
+            self._remove(row)
+        return [(LOG_DELETE, row) for row in deleted]
+
+    def values(self) -> list[Mapping]:
+        """Return all rows."""
+        return list(self.rows.values())
+
+    def column_values(self) -> dict[str, list]:
+        """Return the values of all rows per column."""
+        rows = self.values()
+        return {col: [row[col] for row in rows] for col in self.columns}
+
+
+class Interner:
+    """Small integer IDs for strings, so that columns of strings can be stored as integer arrays."""
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.strings: list[str] = []
+
+    def intern(self, string: str) -> int:
+        """Return the ID of the string, assigning the next free ID to a new string."""
+        id_ = self.ids.get(string)
+        if id_ is None:
+            id_ = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return id_
+
+
+class RowView(Mapping):
+    """A read-only row of a `ColumnarTable`, decoded on access. It is only valid until the table changes."""
+
+    __slots__ = ("_table", "_pos")
+
+    def __init__(self, table: "ColumnarTable", pos: int):
+        self._table = table
+        self._pos = pos
+
+    def __getitem__(self, col: str):
+        return self._table._decode(col, self._table.data[col][self._pos])
+
+    def __iter__(self):
+        return iter(self._table.columns)
+
+    def __len__(self) -> int:
+        return len(self._table.columns)
+
+    def __repr__(self) -> str:
+        return f"RowView({dict(self)})"
+
+
+class ColumnarTable(Table):
+    """A table kept column-wise in integer arrays, for the many rows of the uploads and the votes.
+
+    Strings are interned and stored by their ID, so a row takes a few bytes per column instead of a dict. A replaced
+    or removed row only marks its position as free; free positions are dropped once they make up half of the arrays.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        columns: list[str],
+        key_cols: list[str] | None = None,
+        interner: Interner | None = None,
+    ):
+        self.interner = interner or Interner()
+        super().__init__(storage, columns, key_cols)
+
+    def _clear(self) -> None:
+        self.data = {col: array("i") for col in self.columns}
+        self.alive = bytearray()
+        self.positions: dict[tuple, int] = {}
+
+    def _decode(self, col: str, value: int):
+        return value if col in INT_COLUMNS else self.interner.strings[value]
+
+    def _encode(self, col: str, value, add: bool = True) -> int | None:
+        """Return the stored value, or None if the string was never interned and `add` is not set."""
+        if col in INT_COLUMNS:
+            return value
+        return self.interner.intern(value) if add else self.interner.ids.get(value)
+
+    def _set(self, row: dict) -> None:
+        key = tuple(self._encode(col, row[col]) for col in self.key_cols)
+        pos = self.positions.get(key)
+        if pos is not None:
+            self.alive[pos] = 0
+
+        self.positions[key] = len(self.alive)
+        self.alive.append(1)
+        for col in self.columns:
+            self.data[col].append(self._encode(col, row[col]))
+
+    def _remove(self, row: Mapping) -> None:
+        pos = self.positions.pop(tuple(self._encode(col, row[col], add=False) for col in self.key_cols), None)
+        if pos is not None:
+            self.alive[pos] = 0
+
+    def _vacuum(self) -> None:
+        """Drop the free positions if they make up more than half of the arrays."""
+        if len(self.alive) <= 2 * len(self.positions):
+            return
+
+        keep = list(compress(range(len(self.alive)), self.alive))
+        new_positions = {old: new for new, old in enumerate(keep)}
+        self.data = {col: array("i", (values[pos] for pos in keep)) for col, values in self.data.items()}
+        self.alive = bytearray(b"\x01") * len(keep)
+        self.positions = {key: new_positions[pos] for key, pos in self.positions.items()}
+
+    def load(self) -> None:
+        """Load all rows from the storage."""
+        super().load()
+        self._vacuum()
+
+    def upsert(self, content: list[dict], check_cols: list[str] | None = None) -> list[tuple[str, dict]]:
+        """Add rows, overwriting existing rows with the same values in `check_cols`."""
+        records = super().upsert(content, check_cols)
+        self._vacuum()
+        return records
+
+    def delete(self, predicate) -> list[tuple[str, dict]]:
+        """Remove all rows for which the predicate holds."""
+        records = super().delete(predicate)
+        self._vacuum()
+        return records
+
+    def values(self) -> list[RowView]:
+        """Return views of all rows."""
+        return [RowView(self, pos) for pos in compress(range(len(self.alive)), self.alive)]
+
+    def column_values(self) -> dict[str, list]:
+        """Return the values of all rows per column, decoded a column at a time."""
+        strings = self.interner.strings
+        return {
+            col: list(compress(values, self.alive))
+            if col in INT_COLUMNS
+            else [strings[value] for value in compress(values, self.alive)]
+            for col, values in self.data.items()
+        }
+
+    def select(self, **values) -> list[RowView]:
+        """Return views of the rows with the given values in the given columns."""
+        encoded = {col: self._encode(col, value, add=False) for col, value in values.items()}
+        if None in encoded.values():
+            return []
+
+        positions = compress(range(len(self.alive)), self.alive)
+        for col, value in encoded.items():
+            column = self.data[col]
+            positions = [pos for pos in positions if column[pos] == value]
+        return [RowView(self, pos) for pos in positions]
+
+    def count(self, *cols: str) -> dict[tuple, int]:
+        """Count the rows per combination of values in the columns."""
+        counts = Counter(compress(zip(*(self.data[col] for col in cols)), self.alive))
+        return {tuple(self._decode(col, value) for col, value in zip(cols, values)): n for values, n in counts.items()}
+
+
+class VotingProgress:
+    """Which users voted in which category, with a per-category count of eligible users that voted."""
+
+    def __init__(self):
+        self.eligible_users: dict[str, None] = {}
+        self.voters: dict[int, set[str]] = {}
+        self.n_voted: dict[int, int] = {}
+
+    def add_user(self, user: str) -> None:
+        """Register a user that has to vote in all categories. The admin does not vote."""
+        if user == "admin" or user in self.eligible_users:
+            return
+
+        self.eligible_users[user] = None
+        for cat_id, voters in self.voters.items():
+            self.n_voted[cat_id] += user in voters
+
+    def add_vote(self, cat_id: int, user: str) -> None:
+        """Mark the category as voted for by the user. Voting again changes nothing."""
+        voters = self.voters.setdefault(cat_id, set())
+        if user in voters:
+            return
+
+        voters.add(user)
+        self.n_voted[cat_id] = self.n_voted.get(cat_id, 0) + (user in self.eligible_users)
+
+    def has_voted(self, cat_id: int, user: str) -> bool:
+        """Check whether the user voted in the category."""
+        return user in self.voters.get(cat_id, ())
+
+    def is_complete(self, cat_id: int) -> bool:
+        """Check if all eligible users voted in the category."""
+        return self.n_voted.get(cat_id, 0) == len(self.eligible_users)
+
+    def status(self, cat_id: int) -> dict[str, bool]:
+        """Return a dict with eligible users and their voting status for the category."""
+        voters = self.voters.get(cat_id, ())
+        return {user: user in voters for user in self.eligible_users}
+
+    def missing_voters(self, cat_id: int) -> list[str]:
+        """Return eligible users that did not vote in the category yet."""
+        voters = self.voters.get(cat_id, ())
+        return [user for user in self.eligible_users if user not in voters]
+
+
+class ScoreAggregates:
+    """Sums of the funny and cringe votes per meme and per author, updated as votes arrive.
+
+    The epoch increases with every change, so results computed from the sums can be cached until it changes.
+    """
+
+    def __init__(self):
+        self.votes: dict[tuple[str, int, str], tuple[int, int]] = {}
+        self.meme_sums: dict[tuple[int, str], tuple[int, int]] = {}
+        self.authors: dict[tuple[int, str], str] = {}
+        self.author_sums: dict[str, tuple[int, int]] = {}
+        self.epoch = 0
+
+    @staticmethod
+    def _add(sums: dict, key, delta: tuple[int, int]) -> None:
+        funny, cringe = sums.get(key, (0, 0))
+        sums[key] = funny + delta[0], cringe + delta[1]
+
+    def reset_votes(self) -> None:
+        """Forget all votes, but keep the authors."""
+        self.votes, self.meme_sums, self.author_sums = {}, {}, {}
+        self.epoch += 1
+
+    def reset_authors(self) -> None:
+        """Forget all authors, but keep the votes."""
+        self.authors, self.author_sums = {}, {}
+        self.epoch += 1
+
+    def set_vote(self, user: str, cat_id: int, img_name: str, funny: int, cringe: int) -> None:
+        """Add a vote, replacing the previous vote of the user for the meme."""
+        meme = (cat_id, img_name)
+        old_funny, old_cringe = self.votes.get((user, *meme), (0, 0))
+        delta = funny - old_funny, cringe - old_cringe
+        self.votes[(user, *meme)] = funny, cringe
+
+        self._add(self.meme_sums, meme, delta)
+        if meme in self.authors:
+            self._add(self.author_sums, self.authors[meme], delta)
+        self.epoch += 1
+
+    def set_author(self, user: str, cat_id: int, img_name: str) -> None:
+        """Attribute a meme, and the votes it got, to its author."""
+        meme = (cat_id, img_name)
+        if meme in self.authors:
+            return
+
+        self.authors[meme] = user
+        if meme in self.meme_sums:
+            self._add(self.author_sums, user, self.meme_sums[meme])
+        self.epoch += 1
+
+
+class DuplicateUploadError(ValueError):
+    """Another user uploaded the same meme to the category."""
+
+
+class _WriteRequest:
+    """A change waiting for the writer thread, acknowledged once it is persisted."""
+
+    def __init__(self, table: Table, apply):
+        self.table = table
+        self.apply = apply
+        self.done = threading.Event()
+        self.error = None
+
+
+class StateStore:
+    """Users, uploads and votes with the indices needed by the request handlers.
+
+    All changes are funneled through a single writer thread, which applies the changes that arrived together and
+    persists them with one write per table while holding a lock file shared by all processes.
+    """
+
+    def __init__(self, backend: str | None = None, db_path: Path = DB_PATH):
+        if backend not in [None, "csv", "sqlite"]:
+            raise ValueError(f"Unknown storage backend {backend}!")
+
+        self.backend = backend  # from the configuration, if not given
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.file_lock = file_lock(db_path / LOCK_FILE.name)
+        self._tables_by_file = None
+
+        self.ip_to_user: dict[str, str] = {}
+        self.usernames: dict[str, None] = {}
+        self.uploads_by_cat: dict[int, dict[tuple, dict]] = {}
+        self.votes_by_cat_user: dict[tuple[int, str], set[str]] = {}
+        self.progress = VotingProgress()
+        self.scores = ScoreAggregates()
+        self.version = 0  # increased on every change of the indices
+
+        self._compaction_requested = threading.Event()
+        self._closed = threading.Event()
+        self._compactor = None
+        self._write_queue = queue.Queue()
+        self._writer = None
+        self._persisting: set[Table] = set()  # tables the writer thread is writing to the storage
+
+    @property
+    def _tables(self) -> dict[str, Table]:
+        """Return the tables by the name of their CSV file, created on first use."""
+        if self._tables_by_file is None:
+            backend = self.backend or get_config().storage_backend
+            if backend not in ["csv", "sqlite"]:
+                raise ValueError(f"Unknown storage backend {backend}!")
+
+            interner = Interner()  # shared, so users and images have the same IDs in the uploads and the votes
+
+            def storage(csv_file: Path, columns: list[str], key_cols: list[str] | None = None) -> Storage:
+                if backend == "csv":
+                    return CsvStorage(self.db_path / csv_file.name, columns)
+                db_file = self.db_path / get_config().sqlite_file.name
+                return SqliteStorage(db_file, csv_file.stem, columns, key_cols or columns)
+
+            upload_cols = ["user", "cat_id", "img_name"]
+            vote_cols = [*upload_cols, "funny", "cringe"]
+            self._tables_by_file = {
+                IP_TO_USER_FILE.name: Table(storage(IP_TO_USER_FILE, ["ip", "user"]), ["ip", "user"]),
+                USER_TO_IMAGE_FILE.name: ColumnarTable(
+                    storage(USER_TO_IMAGE_FILE, upload_cols), upload_cols, interner=interner
+                ),
+                VOTES_FILE.name: ColumnarTable(
+                    storage(VOTES_FILE, vote_cols, upload_cols), vote_cols, upload_cols, interner=interner
+                ),
+            }
+        return self._tables_by_file
+
+    @property
+    def users(self) -> Table:
+        """Return the table of the users and their IPs."""
+        return self._tables[IP_TO_USER_FILE.name]
+
+    @property
+    def uploads(self) -> ColumnarTable:
+        """Return the table of the uploaded images."""
+        return self._tables[USER_TO_IMAGE_FILE.name]
+
+    @property
+    def votes(self) -> ColumnarTable:
+        """Return the table of the votes."""
+        return self._tables[VOTES_FILE.name]
+
+    def table(self, csv_file: str | Path) -> Table:
+        """Return the table that corresponds to the given CSV file."""
+        return self._tables[Path(csv_file).name]
+
+    def load(self) -> None:
+        """Load all tables from disk and rebuild the indices."""
+        with self.lock, self.file_lock:
+            for table in self._tables.values():
+                table.load()
+                self._reindex(table)
+
+    def refresh(self) -> None:
+        """Reload the tables whose files were changed outside of this store."""
+        with self.lock:
+            for table in self._tables.values():
+                if table not in self._persisting and table.is_stale():
+                    with self.file_lock:
+                        table.load()
+                    self._reindex(table)
+
+    def _reindex(self, table: Table) -> None:
+        if table is self.users:
+            self.ip_to_user, self.usernames = {}, {}
+        elif table is self.uploads:
+            self.uploads_by_cat = {}
+            self.scores.reset_authors()
+        else:
+            self.votes_by_cat_user = {}
+            self.scores.reset_votes()
+        self._index(table, table.values())
+
+        if table is not self.uploads:
+            self.progress = VotingProgress()
+            for user in self.usernames:
+                self.progress.add_user(user)
+            for cat_id, user in self.votes_by_cat_user:
+                self.progress.add_vote(cat_id, user)
+
+    def _index(self, table: Table, rows: list[Mapping]) -> None:
+        self.version += 1
+        if table is self.users:
+            for row in rows:
+                self.ip_to_user[row["ip"]] = row["user"]
+                self.usernames.setdefault(row["user"])
+                self.progress.add_user(row["user"])
+        elif table is self.uploads:
+            for row in rows:
+                cat_uploads = self.uploads_by_cat.setdefault(row["cat_id"], {})
+                key = table._key(row)
+                cat_uploads.pop(key, None)
+                cat_uploads[key] = dict(row)
+                self.scores.set_author(row["user"], row["cat_id"], row["img_name"])
+        else:
+            for row in rows:
+                self.votes_by_cat_user.setdefault((row["cat_id"], row["user"]), set()).add(row["img_name"])
+                self.progress.add_vote(row["cat_id"], row["user"])
+                self.scores.set_vote(row["user"], row["cat_id"], row["img_name"], row["funny"], row["cringe"])
+
+    def write(self, content: list[dict], csv_file: str | Path, check_cols: list[str] | None = None) -> None:
+        """Add rows to a table and wait until they are persisted."""
+        table = self.table(csv_file)
+
+        def apply():
+            records = table.upsert(content, check_cols)
+            self._index(table, [row for _, row in records])
+            return records
+
+        self._submit(_WriteRequest(table, apply))
+
+    def add_uploads(self, rows: list[dict]) -> None:
+        """Add uploads and wait until they are persisted.
+
+        Raise DuplicateUploadError, and add none of them, if another user uploaded one of the memes to its category.
+        The check runs on the writer thread, so uploads of the same meme that arrive together are checked in turn.
+        """
+
+        def apply():
+            owners = {}
+            for row in rows:
+                key = row["cat_id"], row["img_name"]
+                if key not in owners:
+                    cat_uploads = self.uploads_by_cat.get(row["cat_id"], {}).values()
+                    owners[key] = next((other["user"] for other in cat_uploads if other["img_name"] == key[1]), None)
+                if owners[key] not in (None, row["user"]):
+                    raise DuplicateUploadError("This meme was already uploaded to this category!")
+                owners[key] = row["user"]
+
+            records = self.uploads.upsert(rows)
+            self._index(self.uploads, [row for _, row in records])
+            return records
+
+        self._submit(_WriteRequest(self.uploads, apply))
+
+    def delete_uploads(self, cat_id: int, img_name: str) -> None:
+        """Remove the uploads of an image in a category and wait until the removal is persisted."""
+
+        def apply():
+            records = self.uploads.delete(lambda row: row["cat_id"] == cat_id and row["img_name"] == img_name)
+            self._reindex(self.uploads)
+            return records
+
+        self._submit(_WriteRequest(self.uploads, apply))
+
+    def _submit(self, request: _WriteRequest) -> None:
+        with self.lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="writer", daemon=True)
+                self._writer.start()
+
+        self._write_queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+    def _run_writer(self) -> None:
+        try:
+            while True:
+                batch = [self._write_queue.get()]
+                while not self._write_queue.empty():
+                    batch.append(self._write_queue.get_nowait())
+                self._commit([request for request in batch if request is not None])
+                if None in batch:  # closed
+                    return
+        finally:
+            # a writer that died is started again by the next write
+            with self.lock:
+                if self._writer is threading.current_thread():
+                    self._writer = None
+
+    def _commit(self, batch: list[_WriteRequest]) -> None:
+        """Apply the requests in memory and persist them with a single write per table.
+
+        Every request is acknowledged with the error that kept it from being persisted, if any. The lock of the
+        memory is released while the storage is written, so reads are not held up by the sync to the disk. Like
+        everywhere else, the lock of the memory is taken before the lock file, never while the lock file is held.
+        """
+        records: dict[Table, list] = {}
+        try:
+            try:
+                with contextlib.ExitStack() as held:
+                    with self.lock:
+                        held.enter_context(self.file_lock)
+                        self.refresh()
+                        for request in batch:
+                            try:
+                                records.setdefault(request.table, []).extend(request.apply())
+                            except Exception as e:
+                                request.error = e
+                        # nobody else writes while the lock file is held, so the tables being written need no refresh
+                        self._persisting = set(records)
+
+                    try:
+                        for table, table_records in records.items():
+                            if table_records:
+                                table.persist(table_records)
+                    finally:
+                        # others can write once the lock file is released, so the tables must be refreshed again
+                        self._persisting = set()
+            except Exception:
+                with self.lock:
+                    # memory may be ahead of the storage now, so go back to what was persisted
+                    self.load()
+                raise
+        except Exception as e:
+            for request in batch:
+                request.error = request.error or e
+            return
+        finally:
+            for request in batch:
+                request.done.set()
+
+        try:
+            with self.lock, self.file_lock:
+                for table in records:
+                    self._check_log_size(table)
+        except (OSError, sqlite3.Error) as e:
+            # the changes are persisted in the log either way, which is compacted again later
+            logger.warning("Compacting the log after a commit failed: %r", e)
+
+    def _check_log_size(self, table: Table) -> None:
+        if table.log_rows >= LOG_COMPACT_ROWS:
+            if self._compactor is None:
+                table.compact()
+            else:
+                self._compaction_requested.set()
+
+    def compact(self) -> None:
+        """Fold the logs of all tables into their CSV files."""
+        with self.lock, self.file_lock:
+            self.refresh()
+            for table in self._tables.values():
+                if table.log_rows:
+                    table.compact()
+
+    def start_compactor(self, interval: float = LOG_COMPACT_INTERVAL) -> None:
+        """Compact the tables in a background thread, periodically or when a log grows too large."""
+        if self._compactor is not None:
+            return
+
+        def run():
+            while not self._closed.is_set():
+                self._compaction_requested.wait(interval)
+                self._compaction_requested.clear()
+                self.compact()
+
+        self._compactor = threading.Thread(target=run, name="compactor", daemon=True)
+        self._compactor.start()
+
+    def close(self) -> None:
+        """Stop the writer and compactor threads once they are done, compacting the tables a last time."""
+        self._closed.set()
+        with self.lock:
+            writer, compactor = self._writer, self._compactor
+            self._writer = self._compactor = None
+        if writer is not None:
+            self._write_queue.put(None)
+            writer.join()
+        if compactor is not None:
+            self._compaction_requested.set()
+            compactor.join()
+        else:
+            self.compact()
+
+    def get_user(self, ip: str) -> str | None:
+        """Get the user logged in from the IP address."""
+        with self.lock:
+            self.refresh()
+            return self.ip_to_user.get(ip)
+
+    def get_usernames(self) -> list[str]:
+        """Get the names of all users in the order they logged in."""
+        with self.lock:
+            self.refresh()
+            return list(self.usernames)
+
+    def get_users_ips(self) -> dict[str, str]:
+        """Get a dict with user as keys and the corresponding IP as the value."""
+        with self.lock:
+            self.refresh()
+            return {row["user"]: row["ip"] for row in self.users.values()}
+
+    def get_category_uploads(self, cat_id: int) -> list[dict]:
+        """Get the upload rows of a category."""
+        with self.lock:
+            self.refresh()
+            return list(self.uploads_by_cat.get(cat_id, {}).values())
+
+    def get_user_uploads(self, user: str) -> list[dict]:
+        """Get the upload rows of a user, in the order they were uploaded."""
+        with self.lock:
+            self.refresh()
+            return [dict(row) for row in self.uploads.select(user=user)]
+
+    def upload_counts(self) -> dict[tuple[str, int], int]:
+        """Count the uploads per user and category."""
+        with self.lock:
+            self.refresh()
+            return self.uploads.count("user", "cat_id")
+
+    def voting_status(self, cat_id: int) -> dict[str, bool]:
+        """Return a dict with users and their voting status for a category."""
+        with self.lock:
+            self.refresh()
+            return self.progress.status(cat_id)
+
+    def missing_voters(self, cat_id: int) -> list[str]:
+        """Return users that still have to vote in a category."""
+        with self.lock:
+            self.refresh()
+            return self.progress.missing_voters(cat_id)
+
+    def next_open_category(self, cat_ids) -> int | None:
+        """Return the first of the categories in which not everyone voted yet."""
+        with self.lock:
+            self.refresh()
+            return next((cat_id for cat_id in cat_ids if not self.progress.is_complete(cat_id)), None)
+
+    def data_version(self) -> int:
+        """Return a number that changes whenever the data changes, in this or any other process."""
+        with self.lock:
+            self.refresh()
+            return self.version
+
+    def score_epoch(self) -> int:
+        """Return the epoch of the score aggregates."""
+        with self.lock:
+            self.refresh()
+            return self.scores.epoch
+
+    def score_sums(self) -> tuple[int, dict[tuple[int, str], tuple[int, int]], dict[str, tuple[int, int]]]:
+        """Return the epoch and the sums of (funny, cringe) votes per meme and per author."""
+        with self.lock:
+            self.refresh()
+            return self.scores.epoch, dict(self.scores.meme_sums), dict(self.scores.author_sums)
+
+    def rows(self, csv_file: str | Path) -> list[dict]:
+        """Get all rows of a table."""
+        columns = self.columns(csv_file)
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def columns(self, csv_file: str | Path) -> dict[str, list]:
+        """Get all values of a table per column."""
+        with self.lock:
+            self.refresh()
+            return self.table(csv_file).column_values()
+
+    def copy_from(self, other: "StateStore") -> None:
+        """Replace all data with the data of another store, e.g. to migrate between backends."""
+        with self.lock, other.lock, self.file_lock, other.file_lock:
+            other.refresh()
+            for name, table in self._tables.items():
+                table.storage.compact(other._tables[name].values())
+            self.load()
+
+
+class SharedValues:
+    """A small JSON document of values shared by all worker processes.
+
+    It is replaced atomically on every update and re-read only when another process replaced it.
+    """
+
+    def __init__(self, path: Path, defaults: dict):
+        self.path = path
+        self.defaults = defaults
+        self.lock = file_lock(path.with_suffix(".lock"))
+        self._signature = None
+        self._values = dict(defaults)
+
+    def _file_signature(self) -> tuple | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def changed(self) -> bool:
+        """Check if another process changed the values since they were last read here."""
+        return self._file_signature() != self._signature
+
+    def signature(self) -> tuple | None:
+        """Return a value that changes whenever any process changes the values."""
+        return self._file_signature()
+
+    def values(self) -> dict:
+        """Return the current values."""
+        signature = self._file_signature()
+        if signature != self._signature:
+            try:
+                with open(self.path) as f:
+                    self._values = {**self.defaults, **json.load(f)}
+            except FileNotFoundError:
+                self._values = dict(self.defaults)
+            self._signature = signature
+        return dict(self._values)
+
+    def get(self, key: str, default=None):
+        """Return a single value."""
+        return self.values().get(key, default)
+
+    def update(self, **values) -> None:
+        """Change some of the values for all processes."""
+        with self.lock:
+            self._write({**self.values(), **values})
+
+    def remove(self, *keys: str) -> None:
+        """Remove some of the values for all processes."""
+        with self.lock:
+            values = self.values()
+            if any(key in values for key in keys):
+                self._write({key: value for key, value in values.items() if key not in keys})
+
+    def _write(self, new_values: dict) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}")
+        with open(tmp_path, "w") as f:
+            json.dump(new_values, f)
+        os.replace(tmp_path, self.path)
+        self._values, self._signature = new_values, self._file_signature()
+
+    def reset(self) -> None:
+        """Go back to the defaults."""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._values, self._signature = dict(self.defaults), None
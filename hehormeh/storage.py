@@ -0,0 +1,240 @@
+"""Persistence backends for the tables of the in-memory state."""
+
+import abc
+import csv
+import fcntl
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from . import metrics
+
+INT_COLUMNS = {"cat_id", "funny", "cringe"}
+LOG_UPSERT, LOG_DELETE = "+", "-"
+
+
+def _parse_row(row: dict) -> dict:
+    """Convert a row read from a CSV file to proper python types."""
+    return {col: int(value) if col in INT_COLUMNS else value for col, value in row.items()}
+
+
+class Storage(abc.ABC):
+    """Interface of a backend that persists the rows of a single table."""
+
+    log_rows = 0  # number of changes not yet folded into the canonical storage
+
+    @abc.abstractmethod
+    def signature(self):
+        """Return a value that changes whenever the stored data is changed by someone else."""
+
+    @abc.abstractmethod
+    def load(self) -> list[tuple[str, dict]]:
+        """Return all stored changes as `(op, row)` records, to be replayed in order."""
+
+    @abc.abstractmethod
+    def append(self, records: list[tuple[str, dict]]) -> None:
+        """Durably persist `(op, row)` records of upserted or deleted rows."""
+
+    @abc.abstractmethod
+    def compact(self, rows: list[dict]) -> None:
+        """Replace the stored data with the given rows."""
+
+
+class CsvStorage(Storage):
+    """Rows stored in a CSV file, with changes appended to a log file next to it.
+
+    The log is folded back into the CSV file by `compact`. Loading reads the CSV file and the log on top of it.
+    """
+
+    def __init__(self, csv_file: Path, columns: list[str]):
+        self.csv_file = csv_file
+        self.log_file = Path(f"{csv_file}.log")
+        self.name = csv_file.stem
+        self.columns = columns
+
+    def signature(self) -> tuple:
+        """Return modification times and sizes of the CSV and log files."""
+
+        def file_signature(path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return None
+            return stat.st_mtime_ns, stat.st_size
+
+        return file_signature(self.csv_file), file_signature(self.log_file)
+
+    def load(self) -> list[tuple[str, dict]]:
+        """Read the CSV file and the log."""
+        records = []
+        n_bytes = 0
+        if os.path.exists(self.csv_file):
+            with open(self.csv_file, newline="") as f:
+                records.extend((LOG_UPSERT, _parse_row(row)) for row in csv.DictReader(f))
+                n_bytes += f.tell()
+
+        self.log_rows = 0
+        if os.path.exists(self.log_file):
+            with open(self.log_file, newline="") as f:
+                for op, *values in csv.reader(f):
+                    records.append((op, _parse_row(dict(zip(self.columns, values)))))
+                    self.log_rows += 1
+                n_bytes += f.tell()
+
+        metrics.inc("hehormeh_storage_loads_total", table=self.name)
+        metrics.inc("hehormeh_storage_rows_read_total", len(records), table=self.name)
+        metrics.inc("hehormeh_storage_bytes_read_total", n_bytes, table=self.name)
+        return records
+
+    def append(self, records: list[tuple[str, dict]]) -> None:
+        """Append changed rows to the log and sync it to disk."""
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+        with open(self.log_file, "a", newline="") as f:
+            csv.writer(f).writerows([op, *(row[col] for col in self.columns)] for op, row in records)
+            f.flush()
+            os.fsync(f.fileno())
+        self.log_rows += len(records)
+        metrics.inc("hehormeh_storage_writes_total", table=self.name)
+        metrics.inc("hehormeh_storage_rows_written_total", len(records), table=self.name)
+
+    def compact(self, rows: list[dict]) -> None:
+        """Write the rows to the CSV file and drop the log."""
+        os.makedirs(os.path.dirname(self.csv_file), exist_ok=True)
+        tmp_file = Path(f"{self.csv_file}.tmp")
+        with open(tmp_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_file, self.csv_file)
+
+        # replaying the log again after a crash at this point is harmless
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.log_rows = 0
+        metrics.inc("hehormeh_storage_compactions_total", table=self.name)
+
+
+_CONNECTIONS: dict[Path, sqlite3.Connection] = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+
+def _connect(db_file: Path) -> sqlite3.Connection:
+    """Return the connection to the database, shared by all tables in this process."""
+    with _CONNECTIONS_LOCK:
+        if db_file not in _CONNECTIONS:
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+            connection = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            _CONNECTIONS[db_file] = connection
+        return _CONNECTIONS[db_file]
+
+
+class SqliteStorage(Storage):
+    """Rows stored in a table of a SQLite database in WAL mode, upserted on the key columns."""
+
+    INDICES = {
+        "votes": [("cat_id", "user"), ("cat_id", "img_name")],
+        "user_to_image": [("cat_id", "img_name")],
+    }
+
+    def __init__(self, db_file: Path, name: str, columns: list[str], key_cols: list[str]):
+        self.db_file = db_file
+        self.name = name
+        self.columns = columns
+        self.key_cols = key_cols
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """Return the database connection, creating the table and its indices on first use."""
+        if self._db is None:
+            db = _connect(self.db_file)
+            types = ", ".join(f"{col} {'INTEGER' if col in INT_COLUMNS else 'TEXT'} NOT NULL" for col in self.columns)
+            db.execute(f"CREATE TABLE IF NOT EXISTS {self.name} ({types})")
+            db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {self.name}_key ON {self.name} ({', '.join(self.key_cols)})")
+            for cols in self.INDICES.get(self.name, []):
+                db.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.name}_{'_'.join(cols)} ON {self.name} ({', '.join(cols)})"
+                )
+            self._db = db
+        return self._db
+
+    def signature(self) -> int:
+        """Return the data version, which changes only on commits of other connections."""
+        return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self) -> list[tuple[str, dict]]:
+        """Read all rows in insertion order."""
+        rows = self.db.execute(f"SELECT {', '.join(self.columns)} FROM {self.name} ORDER BY rowid")
+        records = [(LOG_UPSERT, dict(row)) for row in rows]
+        metrics.inc("hehormeh_storage_loads_total", table=self.name)
+        metrics.inc("hehormeh_storage_rows_read_total", len(records), table=self.name)
+        return records
+
+    def append(self, records: list[tuple[str, dict]]) -> None:
+        """Upsert or delete rows in one transaction."""
+        # REPLACE deletes the conflicting row, so the new one goes to the end like in the CSV backend
+        placeholders = ", ".join("?" for _ in self.columns)
+        upsert_sql = f"INSERT OR REPLACE INTO {self.name} ({', '.join(self.columns)}) VALUES ({placeholders})"
+        delete_sql = f"DELETE FROM {self.name} WHERE {' AND '.join(f'{col} = ?' for col in self.key_cols)}"
+
+        with self.db:
+            self.db.execute("BEGIN")
+            for op, row in records:
+                if op == LOG_UPSERT:
+                    self.db.execute(upsert_sql, [row[col] for col in self.columns])
+                else:
+                    self.db.execute(delete_sql, [row[col] for col in self.key_cols])
+        metrics.inc("hehormeh_storage_writes_total", table=self.name)
+        metrics.inc("hehormeh_storage_rows_written_total", len(records), table=self.name)
+
+    def compact(self, rows: list[dict]) -> None:
+        """Replace all rows of the table."""
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute(f"DELETE FROM {self.name}")
+            placeholders = ", ".join("?" for _ in self.columns)
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO {self.name} ({', '.join(self.columns)}) VALUES ({placeholders})",
+                [[row[col] for col in self.columns] for row in rows],
+            )
+        metrics.inc("hehormeh_storage_compactions_total", table=self.name)
+
+
+class FileLock:
+    """Exclusive lock on a file, shared between processes. Re-entrant within a thread."""
+
+    def __init__(self, lock_file: Path):
+        self.lock_file = lock_file
+        self._thread_lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
+            self._file = open(self.lock_file, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+_FILE_LOCKS: dict[Path, FileLock] = {}
+
+
+def file_lock(lock_file: Path) -> FileLock:
+    """Return the lock on the file, shared within the process since `flock` locks of one process do not nest."""
+    with _CONNECTIONS_LOCK:
+        return _FILE_LOCKS.setdefault(Path(os.path.abspath(lock_file)), FileLock(lock_file))
@@ -1,25 +1,28 @@
 """Utility functions for the hehormeh app."""
 
-import os
 import socket
 from enum import Enum
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import numpy as np
-import pandas as pd
-import qrcode
-import qrcode.image.svg
-
+from .blobs import unlink_blob
 from .config import (
     ALLOWED_IMG_EXTENSIONS,
-    ID2CAT,
-    ID2CAT_ALL,
-    IP_TO_USER_FILE,
     QR_CODE_IMAGE_SAVE_PATH,
-    UPLOAD_PATH,
+    SCORING_MODES,
     USER_TO_IMAGE_FILE,
+    VOTE_RANGE,
     VOTES_FILE,
+    get_config,
 )
+from .images import remove_variants
+from .metrics import timed
+from .nights import current
+from .reposts import REPOSTS
+
+if TYPE_CHECKING:  # the data stack is imported on first use, to keep the startup fast
+    import numpy as np
+    import pandas as pd
 
 
 class Stages(Enum):
@@ -42,122 +45,127 @@ def has_valid_extension(filename: str) -> bool:
     return Path(filename).suffix.lower() in ALLOWED_IMG_EXTENSIONS
 
 
+@timed
 def get_user_or_none(ip: str) -> str | None:
     """Get the user from the IP address."""
-    if not os.path.exists(IP_TO_USER_FILE):
-        return None
-
-    mapping = dict(pd.read_csv(IP_TO_USER_FILE, header=0)[["ip", "user"]].values)
-    return mapping.get(ip, None)
+    return current().state.get_user(ip)
 
 
 def get_users_ips() -> dict:
     """Get a dict with user as keys and the corresponding IP as the value."""
-    if not os.path.exists(IP_TO_USER_FILE):
-        return None
-
-    return {row.user: row.ip for row in pd.read_csv(IP_TO_USER_FILE, header=0).itertuples(index=False)}
+    return current().state.get_users_ips()
 
 
 def is_voting_valid(funny_votes, cringe_votes):
-    """Check if the user has voted correctly."""
+    """Check if the user has voted correctly, the sliders that were not moved are -1."""
     score_values = set(funny_votes.values()) | set(cringe_votes.values())
-    return all(v != -1 for v in score_values)
+    return all(VOTE_RANGE[0] <= v <= VOTE_RANGE[1] for v in score_values)
 
 
+@timed
 def users_voting_status(cat_id: int) -> dict[str, bool]:
     """Return a dict with users and their voting status for a category."""
-    user_info_df = pd.read_csv(IP_TO_USER_FILE, header=0)
-    eligible_users = user_info_df[user_info_df.user != "admin"].user.unique()
-
-    if not os.path.exists(VOTES_FILE):
-        return {user: False for user in eligible_users}
-
-    votes_df = pd.read_csv(VOTES_FILE, header=0)
-    users_voted = votes_df[votes_df.cat_id == cat_id].user.unique()
-    return {user: user in users_voted for user in eligible_users}
+    return current().state.voting_status(cat_id)
 
 
+@timed
 def users_voting_status_all() -> dict[str, dict[str, bool]]:
     """Gather the voting statuses for all categories."""
-    return {cat_id: users_voting_status(cat_id) for cat_id in ID2CAT.keys()}
+    with current().state.lock:
+        return {cat_id: users_voting_status(cat_id) for cat_id in get_config().id2cat.keys()}
+
+
+@timed
+def users_missing_vote(cat_id: int) -> list[str]:
+    """Return users that still have to vote in a category."""
+    return current().state.missing_voters(cat_id)
 
 
 def category_voting_complete(category_id: int) -> bool:
     """Check if the voting for a category is complete."""
-    return all(users_voting_status(category_id).values())
+    return not users_missing_vote(category_id)
 
 
+@timed
 def get_next_votable_category_id() -> int | None:
     """Return the next category ID that the user can vote for."""
-    categories = {cat_id: cat for cat_id, cat in ID2CAT.items() if not category_voting_complete(cat_id)}
-    if not categories:
-        return None
-    return next(iter(categories))
+    return current().state.next_open_category(get_config().id2cat.keys())
 
 
-def get_image_and_author_info(cat_id: int, username) -> dict:
-    """Return a dict of image paths and info whether the user is the author."""
-    df = read_user_image_dataframe()
-    df = df[df.cat_id == cat_id]
-    df["img_path"] = df.img_name.apply(lambda name: UPLOAD_PATH / ID2CAT[cat_id] / name)
-    return {str(row.img_path): row.user == username for _, row in df.iterrows()}
-
-
-def read_user_image_dataframe(username: str | None = None) -> pd.DataFrame | None:
-    """Read the user2image dataframe."""
-    if not os.path.exists(USER_TO_IMAGE_FILE):
-        return None
+@timed
+def get_category_uploads(cat_id: int) -> list[dict]:
+    """Return the uploads of a category as dicts with user, cat_id and img_name."""
+    return current().state.get_category_uploads(cat_id)
 
-    df = read_data(USER_TO_IMAGE_FILE)
-    if username is not None:
-        df = df[df["user"] == username]
 
-    if df.empty:
-        return None
-
-    return df
+@timed
+def get_image_and_author_info(cat_id: int, username) -> dict:
+    """Return a dict of image paths and info whether the user is the author."""
+    config = get_config()
+    uploads = current().state.get_category_uploads(cat_id)
+    return {
+        str(config.upload_path / config.id2cat[cat_id] / row["img_name"]): row["user"] == username for row in uploads
+    }
 
 
-def get_uploaded_images(username: str) -> dict[str, list[str]]:
+@timed
+def get_uploaded_images(username: str) -> dict[int, list[str]]:
     """Return a dict with images uploaded by a user for each category."""
-    df = read_user_image_dataframe(username)
-    if df is None:
-        return dict()
+    config = get_config()
+    user_images = {}
+    for row in current().state.get_user_uploads(username):
+        img_path = f"{config.upload_path}/{config.id2cat_all[row['cat_id']]}/{row['img_name']}"
+        user_images.setdefault(row["cat_id"], []).append(img_path)
+    return dict(sorted(user_images.items()))
 
-    df["img_path"] = df.apply(lambda r: f"{UPLOAD_PATH}/{ID2CAT_ALL[r.cat_id]}/{r.img_name}", axis=1)
-    return df.groupby("cat_id")["img_path"].apply(list).to_dict()
 
-
-def get_uploaded_images_info() -> dict:
+@timed
+def get_uploaded_images_info() -> dict[str, dict[int, int]]:
     """Return info about which user uploaded memes for which category."""
-    df = read_user_image_dataframe()
-    if df is None:
-        return dict()
-
-    def category_counts(user_df) -> dict[str, int]:
-        """Get category counts for a given user-filtered dataframe."""
-        cat_counts = user_df.groupby("cat_id")["img_name"].count().to_dict()
-        return {cat: cat_counts.get(cat, 0) for cat in ID2CAT_ALL.keys()}
-
-    return df.groupby("user").apply(category_counts).to_dict()
-
-
-def read_data(csv_file: str) -> pd.DataFrame:
-    """Read data from a file. First line is the header. Index is not set."""
-    return pd.read_csv(csv_file, header=0)
-
-
+    id2cat_all = get_config().id2cat_all
+    info = {}
+    for (user, cat_id), count in sorted(current().state.upload_counts().items()):
+        cat_counts = info.setdefault(user, dict.fromkeys(id2cat_all, 0))
+        if cat_id in cat_counts:
+            cat_counts[cat_id] = count
+    return info
+
+
+@timed
+def get_reposts(username: str | None = None) -> list[dict]:
+    """Return the uploads, of a user or of all, that look like memes of other nights, with the look-alikes."""
+    config = get_config()
+    state = current().state
+    uploads = state.get_user_uploads(username) if username else state.rows(USER_TO_IMAGE_FILE)
+    reposts = []
+    for row in uploads:
+        img_path = f"{config.upload_path}/{config.id2cat_all[row['cat_id']]}/{row['img_name']}"
+        matches = REPOSTS.matches(img_path)
+        if matches:
+            reposts.append({"user": row["user"], "image": img_path, "matches": matches})
+    return reposts
+
+
+@timed
+def read_data(csv_file: str) -> "pd.DataFrame":
+    """Read data of a file from the in-memory state. Index is not set."""
+    import pandas as pd
+
+    columns = current().state.columns(csv_file)
+    if not next(iter(columns.values())):
+        return pd.DataFrame(columns=list(columns))  # object columns, as there are no values to infer types from
+    return pd.DataFrame(columns)
+
+
+@timed
 def write_data(content: list[dict], csv_file: str, check_cols: list[str] | None = None):
-    """Write a line to a file. If the line already exists, the line will be overwritten."""
-    os.makedirs(os.path.dirname(csv_file), exist_ok=True)
+    """Write lines to a file. If a line already exists, the line will be overwritten."""
+    current().state.write(content, csv_file, check_cols)
 
-    existing_data = read_data(csv_file) if os.path.exists(csv_file) else None
-    content = pd.DataFrame(content)
 
-    new_data = pd.concat([existing_data, content]) if existing_data is not None else content
-    new_data = new_data.drop_duplicates(check_cols, keep="last")
-    new_data.to_csv(csv_file, index=False)
+def add_uploads(rows: list[dict]) -> None:
+    """Write upload rows, unless another user uploaded one of the memes to its category."""
+    current().state.add_uploads(rows)
 
 
 def is_host_admin(address: str):
@@ -165,13 +173,27 @@ def is_host_admin(address: str):
     return address == "127.0.0.1" or address == "0.0.0.0" or address == "localhost"
 
 
-def reset_image(image_path: str):
-    """Reset image with given name."""
+@timed
+def reset_image(username: str, image_path: str) -> bool:
+    """Remove an upload of the user by the path of its image. Return False if the user has no such upload."""
+    config = get_config()
     image_path = Path(image_path)
-    df = read_data(USER_TO_IMAGE_FILE)
-    df = df[df.img_name != image_path.name]
-    df.to_csv(USER_TO_IMAGE_FILE, index=False)
-    image_path.unlink()
+    row = next(
+        (
+            row
+            for row in current().state.get_user_uploads(username)
+            if config.upload_path / config.id2cat_all[row["cat_id"]] / row["img_name"] == image_path
+        ),
+        None,
+    )
+    if row is None:
+        return False
+
+    current().state.delete_uploads(row["cat_id"], row["img_name"])
+    unlink_blob(image_path)
+    remove_variants(image_path)
+    REPOSTS.remove(image_path)
+    return True
 
 
 def get_private_ip() -> str:
@@ -190,48 +212,144 @@ def get_private_ip() -> str:
 
 def generate_server_link_qr_code(addr: str, port: str) -> None:
     """Generate QR code from the server link."""
+    import qrcode
+    import qrcode.image.svg
+
     url = f"http://{addr}:{port}"
     img = qrcode.make(url, image_factory=qrcode.image.svg.SvgImage)
     with open(QR_CODE_IMAGE_SAVE_PATH, "wb") as qr:
         img.save(qr)
 
 
-def idxmedian(series: pd.Series) -> str:
-    """Return the index of the median value of the series."""
-    return series.index[np.argsort(series.values)[len(series) // 2]]
+def idxmedian(values: "np.ndarray") -> int:
+    """Return the position of the median value, selected without sorting the whole array."""
+    import numpy as np
 
+    middle = len(values) // 2
+    return int(np.argpartition(values, middle)[middle])
 
-def score_memes():
-    """Evaluate meme scores."""
-    votes = read_data(VOTES_FILE)
-    votes["both"] = votes.funny + votes.cringe
 
-    aggregations = [
-        ("jazjaz_ravnovesja", "both", idxmedian),
-        ("jazjaz_notranje_bolečine", "cringe", "idxmax"),
-        ("smesen_ful_majkemi", "both", "idxmax"),
-        ("najnajjazjaz", "funny", "idxmax"),
-    ]
+MEME_AWARDS = [
+    ("jazjaz_ravnovesja", "both", "median"),
+    ("jazjaz_notranje_bolečine", "cringe", "max"),
+    ("smesen_ful_majkemi", "both", "max"),
+    ("najnajjazjaz", "funny", "max"),
+]
+USER_AWARDS = [
+    ("princesa_mediana", "both", "median"),
+    ("grof_smehoslav", "funny", "max"),
+    ("skremžni_knez", "cringe", "max"),
+    ("meme_lord", "both", "max"),
+]
 
-    results = {name: votes.groupby(["cat_id", "img_name"]).sum()[col].agg(func) for name, col, func in aggregations}
 
-    # convert to full path
-    return {award: f"{UPLOAD_PATH}/{ID2CAT[cat_id]}/{img_name}" for award, (cat_id, img_name) in results.items()}
+def compute_awards(sums: dict, awards: list[tuple[str, str, str]]) -> dict:
+    """Compute all awards from the (funny, cringe) sums per key. Ties go to the smallest key."""
+    if not sums:
+        return {}
 
+    import numpy as np
 
-def score_users():
-    """Evaluate user scores."""
-    uploads = read_data(USER_TO_IMAGE_FILE).set_index(["cat_id", "img_name"]).rename(columns={"user": "author"})
-    votes = read_data(VOTES_FILE).set_index(["cat_id", "img_name"]).rename(columns={"user": "voter"})
-    votes["both"] = votes.funny + votes.cringe
+    keys = sorted(sums)
+    funny, cringe = np.array([sums[key] for key in keys]).T
+    columns = {"funny": funny, "cringe": cringe, "both": funny + cringe}
+    return {
+        name: keys[idxmedian(columns[col]) if func == "median" else int(np.argmax(columns[col]))]
+        for name, col, func in awards
+    }
 
-    votes = pd.merge(votes, uploads, left_index=True, right_index=True).reset_index()
 
-    aggregations = [
-        ("princesa_mediana", "both", idxmedian),
-        ("grof_smehoslav", "funny", "idxmax"),
-        ("skremžni_knez", "cringe", "idxmax"),
-        ("meme_lord", "both", "idxmax"),
-    ]
+@timed
+def score_memes(meme_sums: dict | None = None):
+    """Evaluate meme scores."""
+    meme_sums = current().state.score_sums()[1] if meme_sums is None else meme_sums
+    return meme_paths(compute_awards(meme_sums, MEME_AWARDS))
+
 
-    return {name: votes.groupby("author").sum()[col].agg(func) for name, col, func in aggregations}
+def meme_paths(results: dict[str, tuple[int, str]]) -> dict[str, str]:
+    """Convert the (cat_id, img_name) of the memes to their full paths."""
+    config = get_config()
+    return {
+        award: f"{config.upload_path}/{config.id2cat[cat_id]}/{img_name}"
+        for award, (cat_id, img_name) in results.items()
+    }
+
+
+@timed
+def score_users(author_sums: dict | None = None):
+    """Evaluate user scores."""
+    author_sums = current().state.score_sums()[2] if author_sums is None else author_sums
+    return compute_awards(author_sums, USER_AWARDS)
+
+
+def scoring_mode() -> str:
+    """Return the way the awards are given, chosen by the host."""
+    return current().shared.get("scoring", SCORING_MODES[0])
+
+
+@timed
+def get_scoreboard() -> tuple[dict, dict]:
+    """Return meme and user scores of the scoring mode, computed once per epoch of the score aggregates."""
+    return _scoreboard()[:2]
+
+
+def get_award_confidence() -> dict[str, dict]:
+    """Return the share of bootstrap resamples won and the 90% interval of the score per award, if bootstrapped."""
+    return _scoreboard()[2]
+
+
+def _scoreboard() -> tuple[dict, dict, dict]:
+    night = current()
+    mode = scoring_mode()
+    key = night.state.score_epoch(), mode
+    if key in night.scoreboard_cache:
+        return night.scoreboard_cache[key]
+
+    if mode == "sum":
+        epoch, meme_sums, author_sums = night.state.score_sums()
+        board = score_memes(meme_sums), score_users(author_sums), {}
+    else:
+        from .scoring import VoteMatrix
+
+        with night.state.lock:
+            epoch = night.state.score_epoch()
+            matrix = VoteMatrix(night.state.columns(VOTES_FILE), night.state.columns(USER_TO_IMAGE_FILE))
+        if mode == "bootstrap":
+            memes, users = matrix.bootstrap(MEME_AWARDS, by_author=False), matrix.bootstrap(USER_AWARDS, by_author=True)
+            board = (
+                meme_paths({award: result["winner"] for award, result in memes.items()}),
+                {award: result["winner"] for award, result in users.items()},
+                {
+                    award: {"share": result["share"], "interval": result["interval"]}
+                    for award, result in (memes | users).items()
+                },
+            )
+        else:
+            meme_scores, author_scores = matrix.scores(mode)
+            board = score_memes(meme_scores), score_users(author_scores), {}
+
+    night.scoreboard_cache.clear()
+    night.scoreboard_cache[epoch, mode] = board
+    return board
+
+
+def archive_night() -> None:
+    """Freeze the uploads, votes and awards of the night into the archive of all years."""
+    from .archive import ARCHIVE
+
+    night, config = current(), get_config()
+    with night.state.lock:
+        uploads = night.state.columns(USER_TO_IMAGE_FILE)
+        votes = night.state.columns(VOTES_FILE)
+    meme_scores, user_scores = get_scoreboard()
+    ARCHIVE.write(
+        config.year,
+        uploads,
+        votes,
+        meme_paths={
+            (cat_id, img_name): f"{config.upload_path}/{config.id2cat[cat_id]}/{img_name}"
+            for cat_id, img_name in zip(uploads["cat_id"], uploads["img_name"])
+            if cat_id in config.id2cat
+        },
+        awards={"scoring": scoring_mode(), "memes": meme_scores, "users": user_scores},
+    )
@@ -0,0 +1,318 @@
+"""Benchmark the app with concurrent simulated users and time the data functions at synthetic sizes.
+
+The flow of a meme night (login, upload, viewing, voting, scoreboard) is driven through the Flask test client, with
+each user identified by its own `X-Test-IP`. Latencies are reported per endpoint as JSON, e.g.
+
+    $ python scripts/benchmark.py --users 100 --images-per-user 4 --clean -o bench.json
+
+The flow writes the data of the night of the year in `db/`, its archive in `db/archive/<YEAR>/` and its uploads in
+`static/<YEAR>/`, like the simulation scripts, so it refuses to run over them unless `--clean` is given. The data of
+other nights, the archives of other years, the stored files and the repost index are left alone.
+"""
+
+import argparse
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from pathlib import Path
+
+import numpy as np
+
+from hehormeh import ingest, utils
+from hehormeh.app import create_app
+from hehormeh.config import (
+    ARCHIVE_PATH,
+    IP_TO_USER_FILE,
+    LOCK_FILE,
+    ROOT_DIR,
+    STAGE_FILE,
+    UPLOADS_FILE,
+    USER_TO_IMAGE_FILE,
+    VOTES_FILE,
+    Config,
+    get_config,
+    set_config,
+)
+from hehormeh.nights import NIGHTS, Night, serve
+
+
+class Recorder:
+    """Latencies of the requests, per endpoint."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.spans: dict[str, list[float]] = {}
+
+    def request(self, client, method: str, path: str, ip: str | None = None, **kwargs):
+        """Send a request and record its latency under `METHOD /path`."""
+        headers = {"X-Test-IP": ip} if ip else {}
+        endpoint = f"{method} {path}"
+        start = time.perf_counter()
+        response = client.open(path, method=method, headers=headers, **kwargs)
+        end = time.perf_counter()
+
+        # lists and dicts are safe to update from threads under the GIL
+        self.latencies.setdefault(endpoint, []).append(end - start)
+        span = self.spans.setdefault(endpoint, [start, end])
+        span[0], span[1] = min(span[0], start), max(span[1], end)
+        if response.status_code >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response
+
+    def report(self) -> dict:
+        """Return count, throughput and latency percentiles of every endpoint."""
+        report = {}
+        for endpoint, latencies in self.latencies.items():
+            latencies_ms = np.array(latencies) * 1000
+            p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+            start, end = self.spans[endpoint]
+            report[endpoint] = {
+                "count": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(latencies) / max(end - start, 1e-9), 1),
+                "mean_ms": round(float(latencies_ms.mean()), 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+            }
+        return report
+
+
+def night_data(config: Config) -> list[Path]:
+    """Return the existing files and folders of the night of the configuration, which the flow writes."""
+    db_path = config.db_path
+    paths = [
+        *(
+            db_path / f"{file.name}{suffix}"
+            for file in [IP_TO_USER_FILE, USER_TO_IMAGE_FILE, VOTES_FILE]
+            for suffix in ["", ".log", ".tmp"]
+        ),
+        *(Path(f"{config.sqlite_file}{suffix}") for suffix in ["", "-wal", "-shm"]),
+        db_path / LOCK_FILE.name,
+        *(db_path / path.name for file in [STAGE_FILE, UPLOADS_FILE] for path in [file, file.with_suffix(".lock")]),
+        ARCHIVE_PATH / config.year,
+        ROOT_DIR / config.upload_path,
+    ]
+    return [path for path in paths if path.exists()]
+
+
+def fake_images() -> list[tuple[str, bytes]]:
+    """Return sample memes to upload, or stand-in bytes if there are none."""
+    paths = sorted(glob(str(ROOT_DIR / "meme_dump" / "2024_fake" / "*" / "*")))
+    if not paths:
+        # a 1x1 GIF, since uploads have to be valid images
+        gif = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00"
+        gif += b",\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+        return [("meme.gif", gif)]
+    return [(Path(path).name, Path(path).read_bytes()) for path in paths]
+
+
+def run_flow(app, n_users: int, images_per_user: int, concurrency: int, batch: bool = False) -> dict:
+    """Go through a whole meme night with concurrent users and return the per-endpoint report.
+
+    With `batch`, every user uploads all memes in one request and sends all votes in another one, through the API.
+    """
+    recorder = Recorder()
+    admin = app.test_client()
+    users = {f"user{i}": f"10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(1, n_users + 1)}
+    clients = {user: app.test_client() for user in users}
+    images = fake_images()
+    categories = list(get_config().id2cat_all)
+    phases = {}
+
+    def run_phase(name: str, func) -> None:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(func, users))
+        phases[name] = round(time.perf_counter() - start, 3)
+
+    def set_stage(stage: str) -> None:
+        recorder.request(admin, "POST", "/admin", data={"stage": stage})
+
+    def login(user):
+        recorder.request(clients[user], "POST", "/login", users[user], data={"user": user})
+        recorder.request(clients[user], "GET", "/", users[user])
+
+    def upload(user):
+        files, cat_ids = [], []
+        for idx in range(images_per_user):
+            name, data = images[(int(user.removeprefix("user")) * images_per_user + idx) % len(images)]
+            # unique trailing bytes, so the uploads of different users are not deduplicated
+            data += f"{user}-{idx}".encode()
+            files.append((io.BytesIO(data), name))
+            cat_ids.append(categories[idx % len(categories)])
+
+        if batch:
+            data = {"cat_id": cat_ids, "file": files}
+            recorder.request(clients[user], "POST", "/api/uploads", users[user], data=data)
+        else:
+            for file, cat_id in zip(files, cat_ids):
+                recorder.request(clients[user], "POST", "/upload", users[user], data={"cat_id": cat_id, "file": file})
+        recorder.request(clients[user], "GET", "/upload", users[user])
+
+    def view(user):
+        recorder.request(clients[user], "GET", "/", users[user])
+
+    def vote(user, cat_id):
+        recorder.request(clients[user], "GET", "/vote", users[user])
+        data = {"cat_id": cat_id}
+        for idx, row in enumerate(utils.get_category_uploads(cat_id)):
+            if row["user"] != user:
+                data |= {f"img_name_{idx}": row["img_name"], f"funny_{idx}": idx % 101, f"cringe_{idx}": idx * 7 % 101}
+        recorder.request(clients[user], "POST", "/vote", users[user], data=data)
+
+    def vote_all(user):
+        recorder.request(clients[user], "GET", "/vote", users[user])
+        votes = [
+            {"cat_id": cat_id, "img_name": row["img_name"], "funny": idx % 101, "cringe": idx * 7 % 101}
+            for cat_id in get_config().id2cat
+            for idx, row in enumerate(utils.get_category_uploads(cat_id))
+            if row["user"] != user
+        ]
+        recorder.request(clients[user], "POST", "/api/votes", users[user], json={"votes": votes})
+
+    def show_scoreboard(user):
+        recorder.request(clients[user], "GET", "/scoreboard", users[user])
+
+    run_phase("login", login)
+    set_stage("UPLOAD")
+    run_phase("upload", upload)
+    start = time.perf_counter()
+    jobs = NIGHTS.main().jobs
+    while any(job["status"] == ingest.PENDING for job in jobs.values().values()):
+        time.sleep(0.01)
+    phases["ingestion"] = round(time.perf_counter() - start, 3)
+    failed_uploads = len(jobs.values())
+    set_stage("VIEWING")
+    run_phase("viewing", view)
+    start = time.perf_counter()
+    if batch:
+        set_stage("VOTING")
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(vote_all, users))
+        recorder.request(admin, "GET", "/admin")
+    else:
+        for cat_id in get_config().id2cat:
+            # finishing a category goes back to viewing, so the host opens the voting of every category
+            set_stage("VOTING")
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(lambda user: vote(user, cat_id), users))
+            recorder.request(admin, "GET", "/admin")
+    phases["voting"] = round(time.perf_counter() - start, 3)
+    set_stage("SCORE_CALC")
+    run_phase("score_calc", show_scoreboard)
+    recorder.request(admin, "POST", "/scoreboard", data={"stage": "WINNER_ANNOUNCEMENT"})
+    run_phase("winner_announcement", show_scoreboard)
+
+    return {"phases_s": phases, "failed_uploads": failed_uploads, "endpoints": recorder.report()}
+
+
+def timed(func, *args, min_time: float = 0.2) -> dict:
+    """Call the function repeatedly for at least `min_time` seconds and return its per-call time."""
+    times = []
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline or len(times) < 3:
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return {"calls": len(times), "mean_us": round(float(np.mean(times)) * 1e6, 1), "min_us": round(min(times) * 1e6, 1)}
+
+
+def run_micro(n_users: int) -> dict:
+    """Time the data functions of `utils` on a store filled with a full meme night of `n_users` users."""
+    config = get_config()
+    id2cat = config.id2cat
+    with tempfile.TemporaryDirectory() as db_path:
+        night = Night(Config(config.year, storage_backend=config.storage_backend, db_path=Path(db_path)))
+        night.open()
+        store = night.state
+        users = [f"user{i}" for i in range(n_users)]
+        store.write([{"ip": f"ip{i}", "user": user} for i, user in enumerate(users)], IP_TO_USER_FILE)
+        uploads = [
+            {"user": user, "cat_id": cat_id, "img_name": f"{user}_{cat_id}.jpg"} for user in users for cat_id in id2cat
+        ]
+        store.write(uploads, USER_TO_IMAGE_FILE)
+        votes = [
+            {**row, "user": user, "funny": len(user) % 101, "cringe": len(row["img_name"]) % 101}
+            for row in uploads
+            for user in users
+            if user != row["user"]
+        ]
+
+        # the functions go through the night being served, so serve the synthetic one
+        try:
+            with serve(night):
+                results = {
+                    "get_user_or_none": timed(utils.get_user_or_none, "ip0"),
+                    "get_uploaded_images": timed(utils.get_uploaded_images, users[0]),
+                    "get_uploaded_images_info": timed(utils.get_uploaded_images_info),
+                    "get_next_votable_category_id (no votes)": timed(utils.get_next_votable_category_id),
+                    "write_data (one ballot)": timed(
+                        utils.write_data, votes[: len(id2cat)], VOTES_FILE, ["user", "cat_id", "img_name"]
+                    ),
+                }
+                store.write(votes, VOTES_FILE, ["user", "cat_id", "img_name"])
+                cat_id = next(iter(id2cat))
+                results |= {
+                    "users_voting_status": timed(utils.users_voting_status, cat_id),
+                    "users_voting_status_all": timed(utils.users_voting_status_all),
+                    "get_next_votable_category_id": timed(utils.get_next_votable_category_id),
+                    "get_image_and_author_info": timed(utils.get_image_and_author_info, cat_id, users[0]),
+                    "read_data (votes)": timed(utils.read_data, VOTES_FILE),
+                    "score_memes": timed(utils.score_memes),
+                    "score_users": timed(utils.score_users),
+                }
+        finally:
+            night.close()
+        return {"users": n_users, "uploads": len(uploads), "votes": len(votes), "functions": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--year", default="2024", help="Year of the categories to use")
+    parser.add_argument("--users", type=int, default=50, help="Number of simulated users")
+    parser.add_argument("--images-per-user", type=int, default=4, help="Uploads per user, spread over the categories")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of users sending requests at the same time")
+    parser.add_argument("--micro-sizes", default="10,100,250", help="Comma-separated user counts for micro-benchmarks")
+    parser.add_argument("--batch", action="store_true", help="Upload and vote through the batch API in the flow")
+    parser.add_argument("--skip-flow", action="store_true", help="Only run the micro-benchmarks")
+    parser.add_argument("--skip-micro", action="store_true", help="Only run the flow")
+    parser.add_argument(
+        "--clean",
+        action="store_true",
+        help="Remove the data, archive and uploads of the night of the year before the flow",
+    )
+    parser.add_argument("-o", "--output", help="Write the JSON report to a file instead of stdout")
+    args = parser.parse_args()
+
+    config = Config.from_env(args.year)
+    report = {"config": vars(args) | {"storage_backend": config.storage_backend}}
+
+    if not args.skip_flow:
+        existing = night_data(config)
+        if existing and not args.clean:
+            sys.exit(f"{', '.join(map(str, existing))} exist, run with --clean to remove them")
+        for path in existing:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        app = create_app(config)
+        report["flow"] = run_flow(app, args.users, args.images_per_user, args.concurrency, args.batch)
+    else:
+        set_config(config)
+
+    if not args.skip_micro:
+        report["micro"] = [run_micro(int(size)) for size in args.micro_sizes.split(",")]
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
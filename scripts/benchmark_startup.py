@@ -0,0 +1,58 @@
+"""Benchmark the cold start of the command line interface and the app.
+
+Every case is run in a fresh interpreter, so nothing is cached between the runs. Creating the app loads the data in
+`db/`, so don't run this during a meme night. The report is JSON, e.g.
+
+    $ python scripts/benchmark_startup.py --runs 10 -o startup.json
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+CASES = {
+    "python": "pass",
+    "import hehormeh.cli": "import hehormeh.cli",
+    "hehormeh-start --help": "from hehormeh.cli import start_server; start_server(['--help'])",
+    "import hehormeh.app": "import hehormeh.app",
+    "create_app": (
+        "from hehormeh.app import create_app; from hehormeh.config import Config; create_app(Config('{year}'))"
+    ),
+    "first scoreboard": (
+        "from hehormeh.app import create_app; from hehormeh.config import Config; from hehormeh import utils; "
+        "create_app(Config('{year}')); utils.get_scoreboard()"
+    ),
+}
+
+
+def run_case(code: str, runs: int) -> dict:
+    """Run the code in fresh interpreters and return the wall times in milliseconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(times), 1),
+        "min_ms": round(min(times), 1),
+        "max_ms": round(max(times), 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--year", default="2024", help="Year of the categories to use")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs of every case")
+    parser.add_argument("-o", "--output", help="Write the JSON report to a file instead of stdout")
+    args = parser.parse_args()
+
+    report = {name: run_case(code.format(year=args.year), args.runs) for name, code in CASES.items()}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
@@ -0,0 +1,166 @@
+"""Check that worker processes sharing one database see each other's writes, without hanging.
+
+Two processes open a state store on the same temporary database. Each writes users and votes from several threads,
+while other threads keep reading and a compactor folds the logs, and then checks that it sees the rows of both, e.g.
+
+    $ python scripts/check_workers.py --backend sqlite --writes 600
+
+With `--app`, every process creates the app on the database instead, like a worker of the production mode. The host
+opens the voting through the first worker, and the users of both workers vote through the batch API while the
+index and admin pages are requested. Both workers have to end up with all votes and the same stage and category.
+
+The exit code is 1 if the processes hang, miss rows or disagree.
+"""
+
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from hehormeh.config import IP_TO_USER_FILE, VOTES_FILE, Config, set_config
+from hehormeh.state import StateStore
+
+WORKERS = ("worker1", "worker2")
+
+
+def run_concurrently(read, write, n_writes: int) -> None:
+    """Call `write` for every number below `n_writes` from a pool, while threads keep calling `read`."""
+    stop = threading.Event()
+
+    def keep_reading():
+        while not stop.is_set():
+            read()
+
+    readers = [threading.Thread(target=keep_reading) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(write, range(n_writes)))
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+
+def run_store(name: str, config: Config, n_writes: int, barrier, results) -> None:
+    """Write and read concurrently with the other worker, then report how many rows of both are seen."""
+    set_config(config)
+    store = StateStore(db_path=config.db_path)
+    store.load()
+    store.start_compactor(interval=0.05)
+    barrier.wait()
+
+    def read():
+        store.get_usernames()
+        store.voting_status(0)
+        store.data_version()
+
+    def write(i):
+        user = f"{name}-{i}"
+        store.write([{"ip": user, "user": user}], IP_TO_USER_FILE)
+        vote = {"user": user, "cat_id": 0, "img_name": f"{i}.jpg", "funny": 1, "cringe": 2}
+        store.write([vote], VOTES_FILE, check_cols=["user", "cat_id", "img_name"])
+
+    run_concurrently(read, write, n_writes)
+    barrier.wait()  # the other worker is done writing too
+    results.put((name, len(store.get_usernames()), len(store.rows(VOTES_FILE))))
+    store.close()
+
+
+def run_app(name: str, config: Config, n_users: int, barrier, results) -> None:
+    """Vote through the app with half of the users while the other worker does the same, then report what is seen."""
+    from hehormeh.app import create_app
+    from hehormeh.nights import NIGHTS
+
+    app = create_app(config)
+    host, client = app.test_client(), app.test_client()
+    night = NIGHTS.main()
+    first = name == WORKERS[0]
+    users = {
+        f"{worker}-{i}": f"10.0.{worker_idx}.{i}" for worker_idx, worker in enumerate(WORKERS) for i in range(n_users)
+    }
+    own_users = [user for user in users if user.startswith(f"{name}-")]
+    errors = []
+
+    def request(method: str, path: str, ip: str | None = None, **kwargs):
+        response = (client if ip else host).open(path, method=method, headers={"X-Test-IP": ip} if ip else {}, **kwargs)
+        if response.status_code >= 400:
+            errors.append(f"{method} {path} {response.status_code}")
+        return response
+
+    for user in own_users:
+        request("POST", "/login", users[user], data={"user": user})
+    if first:
+        night.state.add_uploads([{"user": user, "cat_id": 0, "img_name": f"{user}.jpg"} for user in users])
+    barrier.wait()  # all users are logged in
+    if first:
+        request("GET", "/", users[own_users[0]])  # the category with the uploads is viewed first
+        request("POST", "/admin", data={"stage": "VOTING"})
+    barrier.wait()  # the voting is open
+
+    def read():
+        request("GET", "/", users[own_users[0]])
+        request("GET", "/admin")
+
+    def write(i):
+        user = own_users[i]
+        votes = [
+            {"cat_id": 0, "img_name": f"{other}.jpg", "funny": 50, "cringe": 50} for other in users if other != user
+        ]
+        request("POST", "/api/votes", users[user], json={"votes": votes})
+
+    run_concurrently(read, write, len(own_users))
+
+    barrier.wait()  # the other worker is done voting too
+    stage = night.shared.values()
+    results.put((name, len(night.state.rows(VOTES_FILE)), stage["stage"], stage.get("cat_id"), errors[:5]))
+    night.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--year", default="2024", help="Year of the categories to use")
+    parser.add_argument("--backend", default="csv", choices=["csv", "sqlite"], help="Storage backend to check")
+    parser.add_argument("--writes", type=int, default=600, help="Users and votes written by every worker")
+    parser.add_argument(
+        "--app", action="store_true", help="Vote through the app of every worker, with a user per 20 writes"
+    )
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds after which the workers count as hung")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config(args.year, storage_backend=args.backend, db_path=Path(tmp_dir))
+        barrier, results = multiprocessing.Barrier(len(WORKERS)), multiprocessing.Queue()
+        target, n_writes = (run_app, args.writes // 20) if args.app else (run_store, args.writes)
+        processes = [
+            multiprocessing.Process(target=target, args=(name, config, n_writes, barrier, results)) for name in WORKERS
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(args.timeout)
+
+        hung = [process.name for process in processes if process.is_alive()]
+        for process in processes:
+            process.kill()
+        if hung:
+            sys.exit(f"{', '.join(hung)} hung")
+
+        seen = [results.get() for _ in range(results.qsize())]
+        if args.app:
+            n_users = len(WORKERS) * n_writes
+            expected = n_users * (n_users - 1)
+            for name, n_votes, stage, cat_id, errors in seen:
+                print(f"{name}: {n_votes} of {expected} votes, stage {stage} of category {cat_id}, errors {errors}")
+            failed = len({(n_votes, stage, cat_id) for _, n_votes, stage, cat_id, _ in seen}) != 1
+            failed |= any(n_votes != expected or errors for _, n_votes, _, _, errors in seen)
+        else:
+            expected = len(WORKERS) * args.writes
+            for name, n_users, n_votes in seen:
+                print(f"{name}: {n_users} of {expected} users, {n_votes} of {expected} votes")
+            failed = any(n_users != expected or n_votes != expected for _, n_users, n_votes in seen)
+        sys.exit(failed or len(seen) != len(WORKERS) or any(process.exitcode for process in processes))
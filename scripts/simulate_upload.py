@@ -1,15 +1,13 @@
 """Simulate upload of memes to the server."""
 
-import os
-
-os.environ["YEAR"] = "2024"
-
 import subprocess
 from glob import glob
 
 import requests
 
-from hehormeh.config import ID2CAT, IP_TO_USER_FILE, ROOT_DIR, TRASH_CATEGORY, TRASH_ID, UPLOAD_PATH, USER_TO_IMAGE_FILE
+from hehormeh.config import IP_TO_USER_FILE, ROOT_DIR, TRASH_CATEGORY, TRASH_ID, USER_TO_IMAGE_FILE, Config
+
+config = Config("2024")
 
 n_users = 5
 users_and_ips = {f"user{i}": f"192.168.0.{i}" for i in range(1, n_users)}
@@ -17,7 +15,7 @@ users_and_ips = {f"user{i}": f"192.168.0.{i}" for i in range(1, n_users)}
 # users_and_ips["bobi"] = "192.168.1.X"
 
 # log in users
-subprocess.run(f"rm -rf {IP_TO_USER_FILE}", shell=True)
+subprocess.run(f"rm -rf {IP_TO_USER_FILE}*", shell=True)
 for user, ip in users_and_ips.items():
     headers = {"X-Test-IP": ip}
     requests.post("http://127.0.0.1:5001/login", data={"user": user}, headers=headers)
@@ -26,19 +24,19 @@ requests.post("http://127.0.0.1:5001/login", data={"user": "admin"}, headers={})
 
 
 # simulate uploads
-subprocess.run(f"rm -rf {UPLOAD_PATH}", shell=True)
-subprocess.run(f"rm -rf {USER_TO_IMAGE_FILE}", shell=True)
+subprocess.run(f"rm -rf {config.upload_path}", shell=True)
+subprocess.run(f"rm -rf {USER_TO_IMAGE_FILE}*", shell=True)
 for idx, (user, ip) in enumerate(users_and_ips.items()):
-    for cat_id, cat in ID2CAT.items():
-        image_path = glob(str(ROOT_DIR / "meme_dump" / "2024_fake" / cat / "*"))[idx]
-
-        headers = {"X-Test-IP": ip}
-        r = requests.post(
-            "http://127.0.0.1:5001/upload",
-            files={"file": open(image_path, "rb")},
-            data={"cat_id": cat_id},
-            headers=headers,
-        )
+    # one request with a meme for every category
+    image_paths = [glob(str(ROOT_DIR / "meme_dump" / "2024_fake" / cat / "*"))[idx] for cat in config.id2cat.values()]
+
+    headers = {"X-Test-IP": ip}
+    r = requests.post(
+        "http://127.0.0.1:5001/api/uploads",
+        files=[("file", open(image_path, "rb")) for image_path in image_paths],
+        data={"cat_id": list(config.id2cat)},
+        headers=headers,
+    )
 
 # simulate trash uploads
 for idx, image_path in enumerate(glob(str(ROOT_DIR / "meme_dump" / "2024_fake" / TRASH_CATEGORY / "*"))):
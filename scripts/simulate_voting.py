@@ -1,10 +1,5 @@
-"""Simulate upload of memes to the server."""
+"""Simulate voting of the users, with all votes of a user sent in a single request."""
 
-import os
-
-import pandas as pd
-
-os.environ["YEAR"] = "2024"
 import random
 import subprocess
 
@@ -13,34 +8,35 @@ import requests
 from hehormeh.config import (
     USER_TO_IMAGE_FILE,
     VOTES_FILE,
+    Config,
+    get_config,
+    set_config,
 )
-from hehormeh.utils import get_next_votable_category_id
+from hehormeh.utils import read_data
+
+set_config(Config("2024"))
 
 n_users = 5
 users_and_ips = {f"user{i}": f"192.168.0.{i}" for i in range(1, n_users)}
 # users_and_ips["matic"] = "192.168.1.X"
 # users_and_ips["bobi"] = "192.168.1.X"
 
-user_uploads_df = pd.read_csv(USER_TO_IMAGE_FILE, header=0)
+user_uploads_df = read_data(USER_TO_IMAGE_FILE)
 
 
 # simulate voting
-subprocess.run(f"rm -rf {VOTES_FILE}", shell=True)
-while get_next_votable_category_id() is not None:
-    cat_id = get_next_votable_category_id()
-
-    for user, ip in users_and_ips.items():
-        data = {"cat_id": cat_id}
-        for idx, row in user_uploads_df[user_uploads_df.cat_id == cat_id].reset_index(drop=True).iterrows():
-            if row.user == user:
-                continue
-
-            data = {
-                **data,
-                f"img_name_{idx}": row.img_name,
-                f"funny_{idx}": random.randint(0, 100),
-                f"cringe_{idx}": random.randint(0, 100),
-            }
-
-        headers = {"X-Test-IP": ip}
-        r = requests.post("http://127.0.0.1:5001/vote", data=data, headers=headers)
+subprocess.run(f"rm -rf {VOTES_FILE}*", shell=True)
+for user, ip in users_and_ips.items():
+    votes = [
+        {
+            "cat_id": int(row.cat_id),
+            "img_name": row.img_name,
+            "funny": random.randint(0, 100),
+            "cringe": random.randint(0, 100),
+        }
+        for row in user_uploads_df.itertuples()
+        if row.cat_id in get_config().id2cat and row.user != user
+    ]
+
+    headers = {"X-Test-IP": ip}
+    r = requests.post("http://127.0.0.1:5001/api/votes", json={"votes": votes}, headers=headers)